@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import bump_generation, cache_is_shared, get_cache, get_generation
+
+# JWT authentication without a user query per request
+# simplejwt's JWTAuthentication loads the user row on every authenticated call. CachedJWTAuthentication keeps a
+# few of the row's fields (CACHED_FIELDS, plus a digest of the password hash for simplejwt's revoke check, never the
+# hash itself) in a small per process dict trusted for LOCAL_TTL seconds, and, when CACHES["catalog"] is shared
+# by every process (redis, memcached), in that cache for TTL seconds, keyed by user id and the "user:<id>" generation.
+# Saving or deleting a user (profile edits, password changes, deactivation) bumps its generation and drops the
+# local entry (signals.py), so the change applies at once in the shared cache and in this process, and within
+# LOCAL_TTL in the others. With a per process cache (locmem) the shared layer is off, a generation bump there
+# wouldn't reach the other workers. Call forget_user() after a queryset.update() of users, it sends no signals.
+# Other fields are deferred on the returned user, reading one loads it from the database.
+
+AUTH_CACHE_DEFAULTS = {
+    "TTL": 300, # seconds a user stays in the shared cache
+    "LOCAL_TTL": 5, # seconds a process reuses a user without asking the shared cache, 0 turns the local layer off
+    "LOCAL_SIZE": 1024, # users kept per process, least recently used dropped first
+    "SHARED": None, # use the catalog cache as the shared layer, None: only when it's shared by every process
+}
+# what the api reads from request.user: ids for the order queries, is_staff / is_superuser for the permissions,
+# is_active for the check below, email for payments and djoser's /auth/users/me/
+CACHED_FIELDS = ("id", "email", "first_name", "last_name", "is_active", "is_staff", "is_superuser")
+REVOKE_DIGEST = "password_digest"
+
+
+def auth_cache_settings():
+    return {**AUTH_CACHE_DEFAULTS, **getattr(settings, "AUTH_CACHE", {})}
+
+
+class LocalUsers:
+    # user id -> (expiry, field values), bounded LRU shared by the threads of the process
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, values, ttl, size):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + ttl, values)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_users = LocalUsers()
+
+
+def user_key(user_id):
+    return str(user_id) # the claim of an integer id can come back as a string from other token issuers
+
+
+def forget_user(user_id):
+    key = user_key(user_id)
+    local_users.discard(key)
+    bump_generation(f"user:{key}")
+    # again after commit, a request of this process may have cached the old row in between
+    transaction.on_commit(lambda: local_users.discard(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication that resolves the token's user from the cache, see the module comment """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        values = self.get_cached_values(user_id)
+        if api_settings.CHECK_USER_IS_ACTIVE and not values["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != values[REVOKE_DIGEST]:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        # a new instance per request, views may change request.user without touching the cached values
+        field_names = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in values]
+        return self.user_model.from_db(router.db_for_read(self.user_model), field_names, [values[name] for name in field_names])
+
+    def get_cached_values(self, user_id):
+        options = auth_cache_settings()
+        key = user_key(user_id)
+        values = local_users.get(key) if options["LOCAL_TTL"] > 0 else None
+        if values is not None:
+            return values
+        shared = cache_is_shared() if options["SHARED"] is None else options["SHARED"]
+        if shared:
+            cache = get_cache()
+            shared_key = f"auth:user:{key}:{get_generation(f'user:{key}')}"
+            values = cache.get(shared_key)
+        if values is None:
+            values = self.load_values(user_id) # missing users aren't cached, they fail on every request
+            if shared:
+                cache.set(shared_key, values, timeout=options["TTL"])
+        if options["LOCAL_TTL"] > 0:
+            local_users.set(key, values, options["LOCAL_TTL"], options["LOCAL_SIZE"])
+        return values
+
+    def load_values(self, user_id):
+        fields = {self.user_model._meta.get_field(name).attname for name in (*CACHED_FIELDS, api_settings.USER_ID_FIELD)}
+        try:
+            values = self.user_model.objects.values(*fields, "password").get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+        values[REVOKE_DIGEST] = get_md5_hash_password(values.pop("password"))
+        return values
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from storeapp.models import Reservation
+from storeapp.reservations import reservations_changed
+
+# Response cache for catalog reads.
+# Every namespace ("products", "categories", "reviews:<product id>") has a generation number in the cache,
+# cached responses are keyed by it, so bumping the generation (signals.py) invalidates all of them at once
+# and the old entries simply age out of the cache (LRU / MAX_ENTRIES, see CACHES["catalog"] in settings).
+
+CACHE_ALIAS = getattr(settings, "CATALOG_CACHE_ALIAS", "catalog")
+
+
+def get_cache():
+    if CACHE_ALIAS in settings.CACHES:
+        return caches[CACHE_ALIAS]
+    return caches["default"]
+
+
+def cache_is_shared():
+    # whether every process sees the same catalog cache, locmem (and dummy) caches are per process
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def get_generation(namespace):
+    cache = get_cache()
+    key = f"gen:{namespace}"
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 1, timeout=None)
+        generation = cache.get(key, 1)
+    return generation
+
+
+def _bump(namespace):
+    cache = get_cache()
+    key = f"gen:{namespace}"
+    try:
+        cache.incr(key)
+    except ValueError: # not set yet (or evicted), any new value invalidates the old keys
+        cache.set(key, 2, timeout=None)
+
+
+def on_commit_once(key, func):
+    # transaction.on_commit(func) unless a callback with the same key is already waiting for this transaction's
+    # commit, a bulk delete sends post_delete for every row
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(getattr(callback, "once_key", None) == key for _, callback, *rest in connection.run_on_commit):
+        return
+
+    def callback():
+        callback.once_key = None # ran, the tests' captureOnCommitCallbacks() leaves callbacks in the list
+        func()
+    callback.once_key = key
+    transaction.on_commit(callback)
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_invalidation():
+    # the catalog receivers in signals.py skip the rows written inside, for bulk writes whose caller invalidates once
+    previous = getattr(_deferred, "active", False)
+    _deferred.active = True
+    try:
+        yield
+    finally:
+        _deferred.active = previous
+
+
+def invalidation_deferred():
+    return getattr(_deferred, "active", False)
+
+
+def bump_generation(*namespaces):
+    # bump now so this request sees its own writes, and again after commit so a response
+    # cached by a concurrent reader from the not yet committed data can't outlive the transaction,
+    # the writes of one transaction share the after commit bump
+    for namespace in namespaces:
+        _bump(namespace)
+        on_commit_once(f"bump:{namespace}", lambda namespace=namespace: _bump(namespace))
+
+
+# Reservations stop holding stock when they expire, no write happens then, so nothing would invalidate the
+# responses showing the held stock until `manage.py release_reservations` deletes them from cron. Every
+# reservation change stores the earliest expiry under HOLDS_KEY (signals.py), the first catalog read past it
+# sends reservations_changed itself. A per process cache only knows the expiries of its own process's
+# reservations (and nothing after a restart or an eviction of the key), the cron sweep stays the backstop there.
+HOLDS_KEY = "holds:next_expiry"
+
+
+def remember_holds():
+    expires_at = Reservation.objects.active().aggregate(next=Min("expires_at"))["next"]
+    get_cache().set(HOLDS_KEY, expires_at, timeout=None)
+
+
+def expire_holds():
+    cache = get_cache()
+    expires_at = cache.get(HOLDS_KEY)
+    # only the request that deletes the key sends the signal, its receivers store the next expiry
+    if expires_at is not None and expires_at <= timezone.now() and cache.delete(HOLDS_KEY):
+        reservations_changed.send(sender=Reservation)
+
+
+def get_document(name, namespace, build):
+    # a document precomputed once per generation of namespace (e.g. the category navigation),
+    # returns (document, etag), build() is only called after an invalidation
+    generation = get_generation(namespace)
+    key = f"doc:{name}:{generation}"
+    cache = get_cache()
+    document = cache.get(key)
+    if document is None:
+        document = {"version": generation, **build()}
+        cache.set(key, document)
+    return document, f'W/"{name}-{generation}"'
+
+
+class CachedReadMixin:
+    """ Caches list/retrieve responses per cache namespace, with ETag / If-None-Match support """
+    cache_namespace = None
+
+    def get_cache_namespace(self):
+        return self.cache_namespace
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
+
+    def get_cache_key(self, request, namespace, generation):
+        # the query string is sorted so ?a=1&b=2 and ?b=2&a=1 share an entry,
+        # host and scheme are part of the key because pagination links are absolute urls
+        query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+        variant = f"{request.scheme}://{request.get_host()}{request.path}?{query}|staff={request.user.is_staff}"
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        return f"resp:{namespace}:{generation}:{digest}"
+
+    def cached_response(self, request, get_response):
+        expire_holds()
+        namespace = self.get_cache_namespace()
+        generation = get_generation(namespace)
+        key = self.get_cache_key(request, namespace, generation)
+        etag = f'W/"{key.rsplit(":", 1)[1][:16]}-{generation}"'
+
+        if etag in request.headers.get("If-None-Match", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is None:
+            response = get_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data) # backend TIMEOUT
+        else:
+            response = Response(data)
+        response["ETag"] = etag
+        return response
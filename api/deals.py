@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from storeapp.models import Product
+from .cache import expire_holds, get_cache
+
+logger = logging.getLogger(__name__)
+
+# Deals feeds for the home page (GET /api/deals/top-deals/, /api/deals/flash-sales/)
+# every feed is a precomputed snapshot: the first SIZE flagged products, cheapest first, as ProductReadSerializer
+# renders them, stored in the catalog cache with a version stamp. Requests only read that one cache entry, so
+# their latency doesn't depend on the catalog size. Product / image / category / review / stock changes
+# schedule a rebuild (signals.py) which runs DEBOUNCE seconds later on a background thread, so a burst of
+# edits costs one rebuild. Media urls in the snapshots are relative, they aren't built for a request's host.
+# The rebuild runs in the process that committed the change, other workers only see it through a shared cache
+# backend (CACHES["catalog"] in settings). Snapshots expire after TTL seconds anyway, which bounds how stale a
+# worker with its own cache can get.
+
+DEALS_DEFAULTS = {
+    "SIZE": 48,
+    "DEBOUNCE": 2.0, # seconds, 0 rebuilds right away in the calling thread (tests, management commands)
+    "TTL": 300, # seconds a snapshot is served before a request rebuilds it
+}
+FEEDS = {
+    "top-deals": Q(top_deal=True),
+    "flash-sales": Q(flash_sales=True),
+}
+
+
+def deals_settings():
+    return {**DEALS_DEFAULTS, **getattr(settings, "DEALS", {})}
+
+
+def snapshot_key(feed):
+    return f"deals:{feed}"
+
+
+def build_snapshot(feed):
+    from .serializers import ProductReadSerializer
+    # the ordering follows the partial (old_price, id) indexes on top_deal / flash_sales
+    queryset = (
+        Product.objects.filter(FEEDS[feed]).select_related("category").prefetch_related("images")
+        .defer("search_vector").with_available().order_by("old_price", "id")[:deals_settings()["SIZE"]]
+    )
+    results = ProductReadSerializer(queryset, many=True).data
+    document = {
+        "feed": feed,
+        "version": time.time_ns() // 1000, # microseconds, a later rebuild always has a higher version
+        "built_at": timezone.now(),
+        "count": len(results),
+        "results": results,
+    }
+    get_cache().set(snapshot_key(feed), document, timeout=deals_settings()["TTL"])
+    return document
+
+
+def rebuild_deals():
+    return {feed: build_snapshot(feed) for feed in FEEDS}
+
+
+def get_snapshot(feed):
+    expire_holds()
+    document = get_cache().get(snapshot_key(feed))
+    if document is None: # cold, expired or evicted, the only time a request builds a snapshot
+        document = build_snapshot(feed)
+    return document
+
+
+_timer = None
+_timer_lock = threading.Lock()
+
+
+def schedule_rebuild():
+    # call it after the change is committed (transaction.on_commit), the rebuild must see it
+    global _timer
+    delay = deals_settings()["DEBOUNCE"]
+    if delay <= 0:
+        rebuild_deals()
+        return
+    with _timer_lock:
+        if _timer is not None: # a rebuild is already pending, it will see this change too
+            return
+        _timer = threading.Timer(delay, run_scheduled_rebuild)
+        _timer.daemon = True
+        _timer.start()
+
+
+def run_scheduled_rebuild():
+    # runs on the timer thread, which has its own db connection
+    global _timer
+    with _timer_lock:
+        _timer = None # changes committed from now on schedule the next rebuild
+    try:
+        rebuild_deals()
+    except Exception:
+        logger.exception("could not rebuild the deals snapshots")
+    finally:
+        connection.close()
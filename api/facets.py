@@ -0,0 +1,85 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q
+
+from .cache import expire_holds, get_cache, get_generation
+
+# Facet counts for the catalog sidebar (GET /api/products/facets/)
+# per category counts, an old_price histogram and the discount / top_deal / flash_sales / available counts of the
+# products matching the current search and filters, in one GROUP BY category query with conditional aggregates.
+# Cached per normalized filter key and "products" generation, for FACETS_TTL seconds only: the filters have
+# too many combinations to keep them for long.
+
+FACETS_TTL = getattr(settings, "FACETS_TTL", 60)
+# old_price bucket bounds, low <= old_price < high, the last bucket has no upper bound.
+# A bucket's products are the ones listed by ?old_price__gte=<low>&old_price__lt=<high>
+PRICE_BUCKETS = (0, 25, 50, 100, 250, 500, 1000)
+FLAGS = {
+    "discount": Q(discount=True),
+    "top_deal": Q(top_deal=True),
+    "flash_sales": Q(flash_sales=True),
+    "in_stock": Q(available__gt=0), # the listing's available, inventory minus the units held by cart reservations
+}
+
+
+def price_ranges():
+    bounds = list(PRICE_BUCKETS)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def facet_key(params, names):
+    # only the parameters that change the matching products, stripped and sorted, so pagination / ordering /
+    # ?fields= variants and "?search=Lamp " vs "?search=lamp" share an entry
+    normalized = []
+    for name in sorted(names):
+        for value in params.getlist(name):
+            value = " ".join(value.split())
+            if value:
+                normalized.append((name, value.lower() if name == "search" else value))
+    digest = hashlib.sha1(urlencode(normalized).encode()).hexdigest()
+    return f"facets:{get_generation('products')}:{digest}"
+
+
+def compute_facets(queryset):
+    aggregates = {"count": Count("pk"), "min_price": Min("old_price"), "max_price": Max("old_price")}
+    for name, condition in FLAGS.items():
+        aggregates[name] = Count("pk", filter=condition)
+    for index, (low, high) in enumerate(price_ranges()):
+        condition = Q(old_price__gte=low) if high is None else Q(old_price__gte=low, old_price__lt=high)
+        aggregates[f"price_{index}"] = Count("pk", filter=condition)
+    rows = queryset.with_available().order_by().values("category_id", "category__title", "category__slug").annotate(**aggregates)
+
+    facets = {"count": 0, "categories": [], **{name: 0 for name in FLAGS}}
+    buckets = [0] * len(PRICE_BUCKETS)
+    prices = []
+    for row in rows:
+        facets["count"] += row["count"]
+        facets["categories"].append({
+            "id": row["category_id"], "title": row["category__title"], "slug": row["category__slug"], "count": row["count"],
+        })
+        for name in FLAGS:
+            facets[name] += row[name]
+        for index in range(len(buckets)):
+            buckets[index] += row[f"price_{index}"]
+        prices.extend(price for price in (row["min_price"], row["max_price"]) if price is not None)
+    facets["categories"].sort(key=lambda category: (-category["count"], category["id"] is None, category["title"] or "")) # uncategorized last
+    facets["price"] = {
+        "min": min(prices, default=None),
+        "max": max(prices, default=None),
+        "buckets": [{"min": low, "max": high, "count": count} for (low, high), count in zip(price_ranges(), buckets)],
+    }
+    return facets
+
+
+def get_facets(params, names, build):
+    # build() returns the filtered queryset, it's only called on a cache miss
+    expire_holds()
+    cache = get_cache()
+    key = facet_key(params, names)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(build())
+        cache.set(key, facets, timeout=FACETS_TTL)
+    return facets
@@ -0,0 +1,72 @@
+import copy
+
+# Sparse fieldsets: ?fields=id,name,price keeps only the named fields of a product, cart or order.
+# Relations (a product's category and images, the items of carts and orders) are then rendered as ids,
+# or nested in full when they're named in ?expand= (which also selects them), e.g.
+#   /api/products/?fields=id,name,price&expand=images
+# Without ?fields= responses are unchanged. The viewsets shrink their querysets to match: only() the columns
+# behind the selected fields, and no join / prefetch / annotation for what wasn't asked for.
+
+FIELDS_PARAM = "fields"
+EXPAND_PARAM = "expand"
+
+
+def split_param(value):
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class Fieldset:
+    def __init__(self, fields, expand=()):
+        self.expand = set(expand)
+        self.fields = set(fields) | self.expand
+
+    def selects(self, name):
+        return name in self.fields
+
+    def expands(self, name):
+        return name in self.expand
+
+    def only(self, queryset, computed=None, required=()):
+        # .only() the concrete columns behind the selected fields,
+        # computed maps properties / annotations to the columns they read (e.g. price -> old_price, discount)
+        computed = computed or {}
+        meta = queryset.model._meta
+        concrete = {field.name for field in meta.concrete_fields}
+        columns = {meta.pk.name, *required}
+        for name in self.fields:
+            if name in computed:
+                columns.update(computed[name])
+            elif name in concrete:
+                columns.add(name)
+        return queryset.only(*columns)
+
+
+def get_fieldset(request):
+    # None when the request doesn't ask for a sparse fieldset
+    if request is None:
+        return None
+    params = getattr(request, "query_params", request.GET)
+    fields = split_param(params.get(FIELDS_PARAM, ""))
+    if not fields:
+        return None
+    return Fieldset(fields, split_param(params.get(EXPAND_PARAM, "")))
+
+
+class SparseFieldsetMixin:
+    """
+    Drops the fields not selected by ?fields= and renders the relations listed in collapsed_fields
+    with their collapsed field (ids) unless they're expanded. Only applies to the top level serializer
+    of a request (nested serializers have no request in their context when they're built).
+    """
+    collapsed_fields = {} # field name -> field rendering the relation as ids
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = get_fieldset(self.context.get("request"))
+        if fieldset is None:
+            return
+        for name in list(self.fields):
+            if not fieldset.selects(name):
+                self.fields.pop(name)
+            elif name in self.collapsed_fields and not fieldset.expands(name):
+                self.fields[name] = copy.deepcopy(self.collapsed_fields[name])
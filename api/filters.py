@@ -1,10 +1,28 @@
-from django_filters.rest_framework import FilterSet
+from django_filters.rest_framework import FilterSet, UUIDFilter
+from rest_framework.filters import SearchFilter
 from storeapp.models import Product
+from storeapp.search import search_products
 
 class ProductFilter(FilterSet):
+    # filter on the raw foreign key column, the default ModelChoiceFilter fetches the category first just to validate it
+    category_id = UUIDFilter(field_name="category_id")
+
     class Meta:
         model = Product
         fields = {
             'category_id':['exact'],
-            'old_price': ['gt', 'lt']
-        }
\ No newline at end of file
+            'old_price': ['gt', 'gte', 'lt'] # gte / lt are the bounds of the facet price buckets (api/facets.py)
+        }
+
+
+class ProductSearchFilter(SearchFilter):
+    # ranked full text search over the product index (storeapp/search.py),
+    # falls back to SearchFilter's icontains over search_fields on databases without one
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "")
+        if not text.strip():
+            return queryset
+        results = search_products(queryset, text)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results.order_by("-search_rank", "pk") # an explicit ?ordering= from OrderingFilter still wins
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from rest_framework import serializers
+from storeapp.models import Category, Product, ProductImage
+from storeapp.search import update_product_index
+from .cache import bump_generation, deferred_invalidation
+from .deals import schedule_rebuild
+
+# Streaming product import: rows are read lazily from a CSV or JSON lines file, validated and written
+# one chunk at a time, so memory stays flat whatever the file size.
+#
+# columns: id (optional uuid, existing products are updated), name, description, slug, category (category slug),
+# old_price, discount, inventory, top_deal, flash_sales, images (list in JSONL, "|" separated paths in CSV)
+
+IMPORT_FIELDS = ["name", "description", "slug", "category", "old_price", "discount", "inventory", "top_deal", "flash_sales"]
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    id = serializers.UUIDField(required=False)
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    slug = serializers.SlugField(required=False, allow_blank=True, allow_null=True)
+    category = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    old_price = serializers.FloatField(required=False)
+    discount = serializers.BooleanField(required=False)
+    inventory = serializers.IntegerField(required=False)
+    top_deal = serializers.BooleanField(required=False)
+    flash_sales = serializers.BooleanField(required=False)
+    images = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        # empty cells mean "not given", so model defaults apply
+        row = {key: value for key, value in row.items() if key and value not in ("", None)}
+        if "images" in row:
+            row["images"] = [path for path in row["images"].split("|") if path]
+        yield row
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError as err:
+                yield {"__error__": f"invalid json: {err}"}
+
+
+def open_rows(file, format):
+    # file is a binary or text file object, format "csv" or "jsonl"
+    stream = file if isinstance(file, io.TextIOBase) else io.TextIOWrapper(file, encoding="utf-8", newline="")
+    if format == "csv":
+        return read_csv(stream)
+    if format in ("jsonl", "ndjson"):
+        return read_jsonl(stream)
+    raise ValueError(f"unsupported format {format!r}, expected csv or jsonl")
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ProductImporter:
+    def __init__(self, chunk_size=CHUNK_SIZE, dry_run=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.categories = {} # slug -> category_id (None for unknown slugs)
+        self.report = {"rows": 0, "imported": 0, "images": 0, "error_count": 0, "errors": []}
+        # one serializer validates every row, building one per row deep copies its fields each time
+        self.row_serializer = ProductImportRowSerializer()
+
+    def run(self, rows):
+        for number, chunk in enumerate(chunked(rows, self.chunk_size)):
+            self.import_chunk(chunk, first_line=number * self.chunk_size + 1)
+        if self.report["imported"] and not self.dry_run:
+            bump_generation("products", "categories") # bulk_create doesn't send post_save, invalidate the cached catalog once
+            transaction.on_commit(schedule_rebuild) # and the deals snapshots
+        return self.report
+
+    def add_error(self, line, errors):
+        self.report["error_count"] += 1
+        if len(self.report["errors"]) < MAX_REPORTED_ERRORS:
+            self.report["errors"].append({"line": line, "errors": errors})
+
+    def resolve_categories(self, slugs):
+        # one query per chunk for the slugs not seen before
+        missing = {slug for slug in slugs if slug not in self.categories}
+        if missing:
+            found = dict(Category.objects.filter(slug__in=missing).values_list("slug", "category_id"))
+            for slug in missing:
+                self.categories[slug] = found.get(slug)
+
+    def import_chunk(self, chunk, first_line):
+        self.report["rows"] += len(chunk)
+        valid = []
+        for line, row in enumerate(chunk, start=first_line):
+            if "__error__" in row:
+                self.add_error(line, {"non_field_errors": [row["__error__"]]})
+                continue
+            try:
+                valid.append((line, self.row_serializer.run_validation(row)))
+            except serializers.ValidationError as err:
+                self.add_error(line, err.detail)
+
+        self.resolve_categories({data["category"] for _, data in valid if data.get("category")})
+
+        products, images = {}, {}
+        for line, data in valid:
+            slug = data.pop("category", None)
+            if slug:
+                if self.categories[slug] is None:
+                    self.add_error(line, {"category": [f"Unknown category {slug!r}"]})
+                    continue
+                data["category_id"] = self.categories[slug]
+            image_paths = data.pop("images", None)
+            product = Product(**data)
+            # the same id twice in one chunk would make the upsert touch a row twice, the last row wins
+            products[product.pk] = (product, data.keys())
+            if image_paths is not None:
+                images[product.pk] = image_paths
+            else:
+                images.pop(product.pk, None)
+        # only the columns a row fills are overwritten on an existing product, Product(**data) puts the model
+        # defaults in the others, so rows are upserted in groups of the same filled columns
+        groups = {}
+        for product, columns in products.values():
+            update_fields = tuple(field for field in IMPORT_FIELDS if field in columns or (field == "category" and "category_id" in columns))
+            groups.setdefault(update_fields, []).append(product)
+        products = [product for product, _ in products.values()]
+
+        if self.dry_run:
+            self.report["imported"] += len(products)
+            return
+        if not products:
+            return
+
+        with transaction.atomic():
+            for update_fields, group in groups.items():
+                Product.objects.bulk_create(
+                    group,
+                    batch_size=self.chunk_size,
+                    update_conflicts=True,
+                    unique_fields=["id"],
+                    update_fields=list(update_fields) or ["name"],
+                )
+            if images:
+                # images listed for a product replace the ones it had, run() invalidates the catalog and the deals
+                # once instead of the signals of every deleted image
+                with deferred_invalidation():
+                    ProductImage.objects.filter(product__in=list(images)).delete()
+                image_rows = [ProductImage(product_id=product_id, image=path) for product_id, paths in images.items() for path in paths]
+                ProductImage.objects.bulk_create(image_rows, batch_size=self.chunk_size)
+                self.report["images"] += len(image_rows)
+            update_product_index(products)
+        self.report["imported"] += len(products)
+
+
+def import_products(file, format, chunk_size=CHUNK_SIZE, dry_run=False):
+    return ProductImporter(chunk_size=chunk_size, dry_run=dry_run).run(open_rows(file, format))
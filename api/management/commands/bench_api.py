@@ -0,0 +1,316 @@
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import django
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+
+from core.models import User
+from storeapp.models import Cart, Cartitems, Category, Order, OrderItem, Product
+from storeapp.search import update_product_index
+from api.payments import reset_payment_client
+from .fake_gateway import make_fake_gateway
+
+# the flows benchmarked, in the order they run
+SCENARIOS = [
+    "products-list", "products-search", "products-filter", "categories",
+    "cart-create", "cart-add", "cart-get", "order-create", "pay",
+]
+WORDS = ["lamp", "chair", "phone", "desk", "kettle", "jacket", "camera", "watch", "speaker", "blender"]
+
+
+class InProcessTransport:
+    # requests go through the full django stack (middleware included) in this process, no server needed
+    def __init__(self, host):
+        self.host = host
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client(SERVER_NAME=self.host, raise_request_exception=False)
+        extra = {"HTTP_AUTHORIZATION": f"JWT {token}"} if token else {}
+        data = json.dumps(body) if body is not None else ""
+        response = client.generic(method, path, data, content_type="application/json", **extra)
+        return response.status_code, response.content
+
+
+class HttpTransport:
+    # requests go to a running server (runserver, gunicorn ...) over keep-alive connections
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        headers = {"Authorization": f"JWT {token}"} if token else {}
+        response = session.request(method, self.base_url + path, json=body, headers=headers)
+        return response.status_code, response.content
+
+
+def percentile(ordered, percent):
+    # nearest rank
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, statuses, empties, elapsed):
+    ordered = sorted(latencies)
+    milliseconds = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    errors = sum(1 for status in statuses if status >= 400)
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": counts,
+        "empty": empties, # listings that matched nothing, they measure little
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+            "p50": milliseconds(percentile(ordered, 50)),
+            "p95": milliseconds(percentile(ordered, 95)),
+            "p99": milliseconds(percentile(ordered, 99)),
+            "max": milliseconds(ordered[-1]) if ordered else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load and latency benchmark of the main api flows (catalog reads, carts, checkout, pay against a local fake "
+        "gateway): throughput and p50/p95/p99 per flow at the given concurrency, saved as json to compare commits. "
+        "Creates its own rows and deletes them afterwards. With sqlite, concurrent writes queue on the database lock."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=8, help="client threads, 1 runs in the calling thread")
+        parser.add_argument("--warmup", type=int, default=5, help="untimed requests per scenario")
+        parser.add_argument("--products", type=int, default=200, help="products created for the run")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--base-url", help="benchmark a running server (e.g. http://127.0.0.1:8000) instead of in process; "
+                                               "pay needs that server's FLW_BASE_URL pointed at `manage.py fake_gateway`")
+        parser.add_argument("--host", default="localhost", help="Host header of in process requests, must be in ALLOWED_HOSTS")
+        parser.add_argument("--output", help="json results file (default bench-results/api-<commit>-<time>.json)")
+        parser.add_argument("--compare", help="a previous results file to print the changes against")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.transport = HttpTransport(options["base_url"]) if options["base_url"] else InProcessTransport(options["host"])
+        self.run_id = uuid.uuid4().hex[:8]
+        self.created_carts = []
+        self.setup_data(options["products"])
+        gateway = None
+        try:
+            self.token = self.get_token()
+            settings_override = None
+            if "pay" in options["scenarios"] and not options["base_url"]:
+                gateway = make_fake_gateway()
+                threading.Thread(target=gateway.serve_forever, daemon=True).start()
+                host, port = gateway.server_address[:2]
+                settings_override = override_settings(PAYMENT_GATEWAY={"BASE_URL": f"http://{host}:{port}/v3"})
+                settings_override.enable()
+                reset_payment_client()
+            try:
+                results = {}
+                for name in options["scenarios"]:
+                    results[name] = self.run_scenario(name, options["requests"], options["warmup"], options["concurrency"])
+                    self.print_result(name, results[name])
+            finally:
+                if settings_override is not None:
+                    settings_override.disable()
+                    reset_payment_client()
+        finally:
+            if gateway is not None:
+                gateway.shutdown()
+                gateway.server_close()
+            self.cleanup()
+
+        document = {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "target": options["base_url"] or "in-process",
+            "database": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "products": options["products"],
+            "seed": options["seed"],
+            "results": results,
+        }
+        output = options["output"] or os.path.join("bench-results", f"api-{document['commit'] or 'nocommit'}-{datetime.now():%Y%m%d-%H%M%S}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(document, file, indent=2)
+        self.stdout.write(f"results saved to {output}")
+        if options["compare"]:
+            self.compare(options["compare"], results)
+
+    def setup_data(self, count):
+        self.password = uuid.uuid4().hex
+        self.user = User.objects.create_user(email=f"bench-api-{self.run_id}@example.com", password=self.password)
+        self.categories = Category.objects.bulk_create([
+            Category(title=f"bench {self.run_id} {word}", slug=f"bench-{self.run_id}-{word}") for word in WORDS[:5]
+        ])
+        self.products = Product.objects.bulk_create([
+            Product(
+                name=f"bench {self.run_id} {self.random.choice(WORDS)} {i}", description=f"{self.random.choice(WORDS)} " * 20,
+                old_price=self.random.randint(5, 500), discount=self.random.random() < 0.3,
+                inventory=10 ** 9, category=self.random.choice(self.categories),
+            )
+            for i in range(count)
+        ])
+        update_product_index(self.products) # bulk_create sends no post_save, the search scenario needs them indexed
+
+    def get_token(self):
+        status, content = self.transport.request("POST", "/auth/jwt/create/", {"email": self.user.email, "password": self.password})
+        if status != 200:
+            raise CommandError(f"could not get a token ({status}): {content[:200]!r}")
+        return json.loads(content)["access"]
+
+    def make_carts(self, count, items=3):
+        carts = Cart.objects.bulk_create([Cart() for _ in range(count)])
+        Cartitems.objects.bulk_create([
+            Cartitems(cart=cart, product=product, quantity=self.random.randint(1, 3))
+            for cart in carts for product in self.random.sample(self.products, min(items, len(self.products)))
+        ])
+        self.created_carts.extend(cart.pk for cart in carts)
+        return carts
+
+    def plan(self, name, count):
+        # (method, path, body, authenticated) of every request, prepared before the clock starts
+        if name == "products-list":
+            return [("GET", "/api/products/", None, False)] * count
+        if name == "products-search":
+            # the word of a product of the run ("bench <run id> <word> <i>"), so every search has matches
+            return [("GET", f"/api/products/?search={self.random.choice(self.products).name.split()[2]}", None, False) for _ in range(count)]
+        if name == "products-filter":
+            return [(
+                "GET", f"/api/products/?category_id={self.random.choice(self.categories).pk}"
+                       f"&old_price__gt={self.random.randint(5, 400)}&ordering=-old_price", None, False,
+            ) for _ in range(count)]
+        if name == "categories":
+            return [("GET", "/api/categories/", None, False)] * count
+        if name == "cart-create":
+            return [("POST", "/api/carts/", {}, False)] * count
+        if name == "cart-add":
+            carts = self.make_carts(max(1, count // 10), items=0)
+            return [(
+                "POST", f"/api/carts/{self.random.choice(carts).pk}/items/",
+                {"product": str(self.random.choice(self.products).pk), "quantity": 1}, False,
+            ) for _ in range(count)]
+        if name == "cart-get":
+            carts = self.make_carts(min(count, 50), items=5)
+            return [("GET", f"/api/carts/{self.random.choice(carts).pk}/", None, False) for _ in range(count)]
+        if name == "order-create":
+            return [("POST", "/api/orders/", {"cart_id": str(cart.pk)}, True) for cart in self.make_carts(count)]
+        if name == "pay":
+            orders = Order.objects.bulk_create([Order(owner=self.user, total_price=self.random.randint(10, 900)) for _ in range(min(count, 50))])
+            return [("POST", f"/api/orders/{self.random.choice(orders).pk}/pay/", None, True) for _ in range(count)]
+        raise CommandError(f"unknown scenario {name}")
+
+    def call(self, planned):
+        method, path, body, authenticated = planned
+        started = time.perf_counter()
+        status, content = self.transport.request(method, path, body, self.token if authenticated else None)
+        latency = time.perf_counter() - started
+        if method == "POST" and path == "/api/carts/" and status == 201:
+            self.created_carts.append(json.loads(content)["id"])
+        empty = False
+        if method == "GET" and status == 200:
+            data = json.loads(content)
+            empty = isinstance(data, dict) and data.get("results") == []
+        return status, latency, empty
+
+    def run_scenario(self, name, count, warmup, concurrency):
+        planned = self.plan(name, count + warmup)
+        for request in planned[:warmup]:
+            self.call(request)
+        timed = planned[warmup:]
+        latencies, statuses = [], []
+        empties = 0
+        lock = threading.Lock()
+        position = iter(range(len(timed)))
+
+        def worker():
+            nonlocal empties
+            try:
+                while True:
+                    with lock:
+                        index = next(position, None)
+                    if index is None:
+                        return
+                    status, latency, empty = self.call(timed[index])
+                    with lock:
+                        statuses.append(status)
+                        latencies.append(latency)
+                        empties += empty
+            finally:
+                if threading.current_thread() is not threading.main_thread():
+                    connections.close_all()
+
+        started = time.perf_counter()
+        if concurrency <= 1:
+            worker()
+        else:
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return summarize(latencies, statuses, empties, time.perf_counter() - started)
+
+    def print_result(self, name, result):
+        latency = result["latency_ms"]
+        line = (
+            f"{name:<16} {result['throughput_rps']:>9.1f} req/s  p50 {latency['p50']:>8.2f}ms  "
+            f"p95 {latency['p95']:>8.2f}ms  p99 {latency['p99']:>8.2f}ms"
+        )
+        if result["errors"]:
+            line += f"  {result['errors']} errors {result['statuses']}"
+        self.stdout.write(self.style.ERROR(line) if result["errors"] else line)
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = json.load(file)
+        self.stdout.write(f"compared with {path} (commit {previous.get('commit')}):")
+        for name, result in results.items():
+            before = previous.get("results", {}).get(name)
+            if not before or not before["throughput_rps"] or not before["latency_ms"]["p95"]:
+                continue
+            throughput = (result["throughput_rps"] / before["throughput_rps"] - 1) * 100
+            p95 = (result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1) * 100
+            self.stdout.write(f"  {name:<16} throughput {throughput:+6.1f}%  p95 {p95:+6.1f}%")
+
+    def cleanup(self):
+        OrderItem.objects.filter(order__owner=self.user).delete() # order items PROTECT their order
+        Order.objects.filter(owner=self.user).delete()
+        Cart.objects.filter(pk__in=self.created_carts).delete()
+        Product.objects.filter(pk__in=[product.pk for product in self.products]).delete()
+        Category.objects.filter(pk__in=[category.pk for category in self.categories]).delete()
+        self.user.delete()
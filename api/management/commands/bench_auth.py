@@ -0,0 +1,79 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import User
+from api.authentication import CachedJWTAuthentication, auth_cache_settings, forget_user
+from api.cache import cache_is_shared
+from .bench_api import percentile
+
+# authentication classes compared, with the AUTH_CACHE overrides they run with
+MODES = {
+    "jwt": (JWTAuthentication, {}),
+    "cached-shared": (CachedJWTAuthentication, {"LOCAL_TTL": 0}), # every request asks the shared cache, if there is one
+    "cached": (CachedJWTAuthentication, {}),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Authenticate the same JWT many times with simplejwt's JWTAuthentication and with CachedJWTAuthentication "
+        "(shared cache only, and with the per process layer): queries and latency per request. Creates a user "
+        "for the run and deletes it afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000, help="authentications per mode")
+        parser.add_argument("--users", type=int, default=1, help="tokens of distinct users, requests cycle through them")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        users = [User.objects.create_user(email=f"bench-auth-{run_id}-{i}@example.com") for i in range(options["users"])]
+        factory = APIRequestFactory()
+        requests = [
+            Request(factory.get("/api/orders/", HTTP_AUTHORIZATION=f"JWT {AccessToken.for_user(user)}"))
+            for user in users
+        ]
+        modes = dict(MODES)
+        if not cache_is_shared():
+            self.stdout.write("cached-shared skipped, CACHES['catalog'] is per process so CachedJWTAuthentication doesn't use it")
+            del modes["cached-shared"]
+        try:
+            results = {name: self.run_mode(authentication, overrides, users, requests, options["requests"]) for name, (authentication, overrides) in modes.items()}
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+        baseline = results["jwt"]["queries"]
+        for name, result in results.items():
+            saved = baseline - result["queries"]
+            self.stdout.write(
+                f"{name:<14} {result['queries_per_request']:>6.3f} queries/request ({saved} saved)  "
+                f"mean {result['mean_us']:>8.1f}us  p95 {result['p95_us']:>8.1f}us"
+            )
+
+    def run_mode(self, authentication, overrides, users, requests, count):
+        with override_settings(AUTH_CACHE={**auth_cache_settings(), **overrides}):
+            for user in users: # every mode starts cold, the first request of each user loads it
+                forget_user(user.pk)
+            authenticator = authentication()
+            latencies = []
+            with CaptureQueriesContext(connection) as captured:
+                for index in range(count):
+                    started = time.perf_counter()
+                    user, token = authenticator.authenticate(requests[index % len(requests)])
+                    latencies.append(time.perf_counter() - started)
+        ordered = sorted(latencies)
+        return {
+            "queries": len(captured.captured_queries),
+            "queries_per_request": len(captured.captured_queries) / count,
+            "mean_us": sum(ordered) / count * 1e6,
+            "p95_us": percentile(ordered, 95) * 1e6,
+        }
@@ -0,0 +1,96 @@
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from rest_framework import serializers
+
+from core.models import User
+from storeapp.models import Cart, Cartitems, Order, OrderItem, Product
+from api.serializers import CreateOrderSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent checkouts of a few hot products: throughput, latency, out of stock answers "
+        "and a check that inventory never went below zero. Creates its own rows and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5, help="number of hot products")
+        parser.add_argument("--stock", type=int, default=200, help="starting inventory of every hot product")
+        parser.add_argument("--checkouts", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--items", type=int, default=3, help="products per cart (at most --products)")
+        parser.add_argument("--max-quantity", type=int, default=2)
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(email=f"bench-{run}@example.com")
+        products = [Product.objects.create(name=f"bench {run} #{i}", old_price=10, inventory=options["stock"]) for i in range(options["products"])]
+        carts = []
+        for _ in range(options["checkouts"]):
+            cart = Cart.objects.create()
+            chosen = random.sample(products, min(options["items"], len(products)))
+            Cartitems.objects.bulk_create([
+                Cartitems(cart=cart, product=product, quantity=random.randint(1, options["max_quantity"])) for product in chosen
+            ])
+            carts.append(cart.pk)
+
+        try:
+            results = self.run(carts, user.pk, options["threads"])
+            self.report(results, products, options["stock"])
+        finally:
+            OrderItem.objects.filter(order__owner=user).delete() # order items PROTECT their order
+            Order.objects.filter(owner=user).delete()
+            Cart.objects.filter(pk__in=carts).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            user.delete()
+
+    def checkout(self, cart_id, user_id):
+        started = time.perf_counter()
+        try:
+            serializer = CreateOrderSerializer(data={"cart_id": cart_id}, context={"user_id": user_id})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            outcome = "ordered"
+        except serializers.ValidationError:
+            outcome = "out of stock"
+        except OperationalError: # lock timeouts, sqlite "database is locked"
+            outcome = "failed"
+        finally:
+            connection.close()
+        return outcome, time.perf_counter() - started
+
+    def run(self, carts, user_id, threads):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(lambda cart_id: self.checkout(cart_id, user_id), carts))
+        return {"elapsed": time.perf_counter() - started, "results": results}
+
+    def report(self, results, products, stock):
+        outcomes = [outcome for outcome, _ in results["results"]]
+        latencies = sorted(latency for _, latency in results["results"])
+        elapsed = results["elapsed"]
+        self.stdout.write(f"{len(outcomes)} checkouts in {elapsed:.2f}s ({len(outcomes) / elapsed:.0f}/s)")
+        for outcome in ("ordered", "out of stock", "failed"):
+            self.stdout.write(f"  {outcome}: {outcomes.count(outcome)}")
+        self.stdout.write(
+            f"latency p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
+
+        ids = [product.pk for product in products]
+        left = dict(Product.objects.filter(pk__in=ids).values_list("pk", "inventory"))
+        sold = {pk: 0 for pk in ids}
+        for product_id, quantity in Order.objects.filter(items__product__in=ids).values_list("items__product", "items__quantity"):
+            sold[product_id] += quantity
+        consistent = all(left[pk] >= 0 and left[pk] + sold[pk] == stock for pk in ids)
+        self.stdout.write(f"units sold {sum(sold.values())} of {stock * len(ids)}, inventory left {sorted(left.values())}")
+        if consistent:
+            self.stdout.write(self.style.SUCCESS("No oversell: every product's inventory + units ordered equals its starting stock"))
+        else:
+            self.stdout.write(self.style.ERROR("Inventory and orders disagree"))
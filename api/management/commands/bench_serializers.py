@@ -0,0 +1,71 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from storeapp.models import Category, Product, ProductImage
+from api.renderers import ORJSONRenderer, orjson
+from api.serializers import ProductReadSerializer
+
+
+class DRFProductReadSerializer(ProductReadSerializer):
+    compiled_representation = False # the plain DRF path, as before api/fastpath.py
+
+
+def make_products(count, images=2):
+    # in memory products shaped like the ProductViewset queryset (category joined, images prefetched, annotations), no database
+    categories = [Category(title=f"Category {i}", slug=f"category-{i}") for i in range(10)]
+    now = timezone.now()
+    products = []
+    for i in range(count):
+        product = Product(
+            id=uuid.uuid4(), name=f"Product {i}", description="A product description " * 5, slug=f"product-{i}",
+            inventory=i % 7, old_price=10.0 + i % 100, discount=i % 3 == 0, category=categories[i % 10],
+        )
+        product.available = product.inventory
+        product.review_count = i % 13
+        product.last_reviewed_at = now if i % 2 else None
+        product._prefetched_objects_cache = {"images": [
+            ProductImage(id=i * images + j, product=product, image=f"img/{i}-{j}.jpg", thumbnail=f"img/thumbnails/{i}-{j}.jpg", webp="")
+            for j in range(images)
+        ]}
+        products.append(product)
+    return products
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+class Command(BaseCommand):
+    help = "Per object cost of the product read serializer and JSON renderer, DRF vs the compiled path and orjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson isn't installed, ORJSONRenderer falls back to JSONRenderer"))
+        for size in options["sizes"]:
+            products = make_products(size)
+            drf_time, drf_data = best_of(options["repeat"], lambda: DRFProductReadSerializer(products, many=True).data)
+            fast_time, fast_data = best_of(options["repeat"], lambda: ProductReadSerializer(products, many=True).data)
+            json_time, json_bytes = best_of(options["repeat"], lambda: JSONRenderer().render(drf_data))
+            orjson_time, orjson_bytes = best_of(options["repeat"], lambda: ORJSONRenderer().render(fast_data))
+            if json_bytes != orjson_bytes:
+                raise CommandError(f"outputs differ at {size} products")
+
+            per_object = lambda seconds: f"{seconds / size * 1e6:7.1f}us"
+            self.stdout.write(f"{size} products, {len(json_bytes) / 1024:.0f} KiB of json (identical outputs)")
+            self.stdout.write(f"  serialize  DRF {per_object(drf_time)}  compiled {per_object(fast_time)}  x{drf_time / fast_time:.1f}")
+            self.stdout.write(f"  render     json {per_object(json_time)}  orjson {per_object(orjson_time)}  x{json_time / orjson_time:.1f}")
+            total_before, total_after = drf_time + json_time, fast_time + orjson_time
+            self.stdout.write(f"  total      {per_object(total_before)} -> {per_object(total_after)}  x{total_before / total_after:.1f}")
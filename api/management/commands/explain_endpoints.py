@@ -0,0 +1,140 @@
+import re
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import User
+from storeapp.models import Cart, Category, Order, Product
+from api.cache import CACHE_ALIAS
+from api.urls import cart_router, products_router, router
+
+# extra query strings checked on top of the plain list of an endpoint, {category} is replaced by a category id
+QUERY_PARAMS = {
+    "products": [
+        {"category_id": "{category}", "old_price__gt": "10", "old_price__lt": "500", "ordering": "old_price"},
+        {"category_id": "{category}"},
+        {"ordering": "-old_price"},
+        {"search": "lamp"},
+    ],
+}
+# sqlite: "SCAN storeapp_product" (no index used), "SCAN storeapp_product USING INDEX ..." reads a whole index in order
+SQLITE_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)")
+POSTGRES_SCAN = re.compile(r"\bSeq Scan on (\w+)")
+
+
+def sequential_scans(plan):
+    pattern = POSTGRES_SCAN if connection.vendor == "postgresql" else SQLITE_SCAN
+    return sorted({match.group(1) for match in pattern.finditer(plan)})
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+        rows = cursor.fetchall()
+    # sqlite returns (id, parent, notused, detail) rows, postgresql one line of text per row
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every registered api endpoint (GET list and detail, plus the filters in QUERY_PARAMS and --url), "
+        "EXPLAIN each query it runs and flag the sequential scans. Run it on a database of realistic size "
+        "(`manage.py generate_data`), planners rightly scan tables of a few pages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", action="append", default=[], help="an extra path to check, e.g. /api/products/?top_deal=true")
+        parser.add_argument("--ignore", nargs="+", default=[], help="tables whose scans are expected (small lookup tables)")
+        parser.add_argument("--host", default="localhost", help="Host header of the requests, must be in ALLOWED_HOSTS")
+        parser.add_argument("--plans", action="store_true", help="print every plan, not only the flagged ones")
+        parser.add_argument("--fail", action="store_true", help="exit with an error when a scan is flagged (for CI)")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ("postgresql", "sqlite"):
+            raise CommandError(f"plans of {connection.vendor} aren't understood, only postgresql and sqlite")
+        self.client = APIClient(SERVER_NAME=options["host"])
+        # requests are made as a customer with orders (not staff, so the owner filter is in the order queries)
+        owner = Order.objects.filter(owner__is_staff=False).values_list("owner", flat=True).first()
+        self.user = User.objects.filter(pk=owner).first() or User.objects.filter(is_staff=False).first()
+        if self.user is not None:
+            self.client.force_authenticate(self.user)
+
+        flagged = 0
+        checked = 0
+        for path in self.paths() + options["url"]:
+            response, queries = self.request(path)
+            self.stdout.write(f"{path} -> {response.status_code}, {len(queries)} queries")
+            if not queries and response.status_code == 200:
+                self.stdout.write(self.style.WARNING("  served without a query, nothing was checked"))
+            for query in queries:
+                sql = query["sql"]
+                if not sql.lstrip().upper().startswith("SELECT"):
+                    continue
+                checked += 1
+                plan = explain(sql)
+                scans = [table for table in sequential_scans(plan) if table not in options["ignore"]]
+                if scans:
+                    flagged += 1
+                    self.stdout.write(self.style.WARNING(f"  sequential scan of {', '.join(scans)}: {sql[:300]}"))
+                if scans or options["plans"]:
+                    self.stdout.write("    " + plan.replace("\n", "\n    "))
+
+        summary = f"{checked} queries explained, {flagged} with sequential scans"
+        if flagged and options["fail"]:
+            raise CommandError(summary)
+        self.stdout.write(self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary))
+
+    def request(self, path):
+        # the catalog responses would come from the cache (a shared one keeps them across runs), not the database
+        no_cache = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        with override_settings(CACHES={**settings.CACHES, CACHE_ALIAS: no_cache}), CaptureQueriesContext(connection) as captured:
+            response = self.client.get(path)
+        return response, captured.captured_queries
+
+    def paths(self):
+        samples = {
+            "product": Product.objects.values_list("pk", flat=True).first(),
+            "cart": Cart.objects.values_list("pk", flat=True).first(),
+            "category": Category.objects.values_list("pk", flat=True).first(),
+        }
+        paths = []
+        for prefix, viewset, basename in router.registry:
+            paths.extend(self.endpoint_paths(f"/api/{prefix}/", prefix, viewset, samples, {}))
+        for parent_router, parent, lookup in ((products_router, "products", "product"), (cart_router, "carts", "cart")):
+            if samples[lookup] is None:
+                continue
+            for prefix, viewset, basename in parent_router.registry:
+                kwargs = {f"{lookup}_pk": str(samples[lookup])}
+                paths.extend(self.endpoint_paths(f"/api/{parent}/{samples[lookup]}/{prefix}/", prefix, viewset, samples, kwargs))
+        return paths
+
+    def endpoint_paths(self, base, prefix, viewset, samples, kwargs):
+        paths = []
+        if hasattr(viewset, "list"):
+            paths.append(base)
+            for params in QUERY_PARAMS.get(prefix, []):
+                if "{category}" in params.values() and samples["category"] is None:
+                    continue
+                query = {name: value.replace("{category}", str(samples["category"])) for name, value in params.items()}
+                paths.append(f"{base}?{urlencode(query)}")
+        if hasattr(viewset, "retrieve"):
+            pk = self.sample_pk(viewset, kwargs)
+            if pk is not None:
+                paths.append(f"{base}{pk}/")
+        return paths
+
+    def sample_pk(self, viewset, kwargs):
+        # an object the detail route serves to this user, from the viewset's own get_queryset()
+        request = Request(APIRequestFactory().get("/"))
+        request.user = self.user or AnonymousUser()
+        view = viewset(request=request, args=(), kwargs=kwargs, action="retrieve", format_kwarg=None)
+        if not all(permission.has_permission(request, view) for permission in view.get_permissions()):
+            return None # e.g. orders when the database has no customer
+        return view.get_queryset().values_list("pk", flat=True).first()
@@ -0,0 +1,76 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class FakeGatewayHandler(BaseHTTPRequestHandler):
+    # answers POST /v3/payments like flutterwave does, after the configured latency
+    protocol_version = "HTTP/1.1" # keep-alive, so the client connection pool is exercised like in production
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if random.random() < self.error_rate:
+            return self.send_json(503, {"status": "error", "message": "Service unavailable"})
+        if not self.path.rstrip("/").endswith("/payments"):
+            return self.send_json(404, {"status": "error", "message": "Not found"})
+        self.send_json(200, {
+            "status": "success",
+            "message": "Hosted Link",
+            "data": {"link": f"http://{self.headers.get('Host')}/pay/{body.get('tx_ref', uuid.uuid4())}"},
+        })
+
+    def send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError): # the client gave up waiting (read timeout)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_fake_gateway(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+    # port=0 picks a free port, read it back from server.server_address
+    handler = type("ConfiguredFakeGatewayHandler", (FakeGatewayHandler,), {
+        "latency": latency, "jitter": jitter, "error_rate": error_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the flutterwave payments API, point PAYMENT_GATEWAY['BASE_URL'] at http://host:port/v3"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every response")
+        parser.add_argument("--jitter", type=float, default=0.0, help="random +/- seconds around the latency")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+
+    def handle(self, *args, **options):
+        server = make_fake_gateway(options["host"], options["port"], options["latency"], options["jitter"], options["error_rate"])
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Fake payment gateway on http://{host}:{port}/v3 (latency {options['latency']}s)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
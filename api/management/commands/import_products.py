@@ -0,0 +1,34 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import CHUNK_SIZE, import_products
+
+
+class Command(BaseCommand):
+    help = "Stream products from a CSV or JSON lines file into the catalog with batched upserts (see api/importer.py for the columns)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="validate only, nothing is written")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or path.rsplit(".", 1)[-1].lower()
+        started = time.monotonic()
+        try:
+            with open(path, "rb") as file:
+                report = import_products(file, format, chunk_size=options["chunk_size"], dry_run=options["dry_run"])
+        except (OSError, ValueError) as err:
+            raise CommandError(str(err))
+        elapsed = time.monotonic() - started
+
+        for error in report["errors"]:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['imported']} of {report['rows']} rows imported ({report['images']} images, {report['error_count']} errors) "
+            f"in {elapsed:.1f}s, {report['rows'] / max(elapsed, 1e-9):.0f} rows/s"
+        ))
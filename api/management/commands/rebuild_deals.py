@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.deals import rebuild_deals
+
+
+class Command(BaseCommand):
+    help = "Rebuild the deals snapshots now, e.g. after writes that skip model signals (bulk_create, update, generate_data)"
+
+    def handle(self, *args, **options):
+        for feed, document in rebuild_deals().items():
+            self.stdout.write(f"{feed}: {document['count']} products, version {document['version']}")
+        self.stdout.write(self.style.SUCCESS("Deals snapshots rebuilt"))
@@ -0,0 +1,215 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import serializers
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+logger = logging.getLogger(__name__)
+
+# Per request instrumentation
+# RequestMetricsMiddleware counts and times every query of a request (on every database connection), groups them by
+# SQL shape to spot N+1 style repeats, times the serializers and the whole request, sends it all back in a
+# Server-Timing header and adds it to per route histograms, served in the Prometheus text format on /metrics/
+# (staff only). The histograms live in the process: every worker exposes its own, scrape them one by one.
+# Disabled, the middleware removes itself from the stack when the server starts and costs nothing.
+
+METRICS_DEFAULTS = {
+    "ENABLED": False,
+    "SERVER_TIMING": True, # tells clients how long the database and serializers took, turn off if that's a concern
+    "REPEATED_QUERY_WARNING": 10, # log the request when it repeats a query shape this many times, 0 never logs
+}
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# metric name -> (help, buckets, RequestMetrics attribute)
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Time spent handling the request", TIME_BUCKETS, "total_time"),
+    "http_request_db_seconds": ("Time spent running database queries", TIME_BUCKETS, "db_time"),
+    "http_request_serializer_seconds": ("Time spent building serializer output (queries it runs included)", TIME_BUCKETS, "serializer_time"),
+    "http_request_queries": ("Database queries run by the request", COUNT_BUCKETS, "queries"),
+    "http_request_repeated_queries": ("Queries repeating a SQL shape the request already ran (N+1 suspects)", COUNT_BUCKETS, "repeated"),
+}
+
+IN_LIST = re.compile(r"\((?:%s, )+%s\)")
+
+
+def metrics_settings():
+    from django.conf import settings
+    return {**METRICS_DEFAULTS, **getattr(settings, "METRICS", {})}
+
+
+def sql_shape(sql):
+    # the parameters aren't in the sql, only the length of IN (...) lists differs between queries of the same shape
+    return IN_LIST.sub("(%s...)", sql)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.total_time = 0.0
+        self.shapes = {}
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context): # a connection.execute_wrapper()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            shape = sql_shape(sql)
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    @property
+    def repeated(self):
+        return sum(count - 1 for count in self.shapes.values())
+
+    def most_repeated(self):
+        return max(self.shapes.items(), key=lambda item: item[1], default=(None, 0))
+
+    def server_timing(self):
+        return (
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries, {self.repeated} repeated", '
+            f"serializer;dur={self.serializer_time * 1000:.1f}, total;dur={self.total_time * 1000:.1f}"
+        )
+
+
+_current = ContextVar("request_metrics", default=None)
+_instrumented = False
+
+
+def instrument_serializers():
+    # times serializer.data, the entry point of top level serializers (nested ones and the children of a list
+    # serializer are only called through to_representation), once per process and only when metrics are enabled
+    global _instrumented
+    if _instrumented:
+        return
+    data = serializers.BaseSerializer.data.fget
+
+    def timed_data(self):
+        metrics = _current.get()
+        if metrics is None or metrics.serializing:
+            return data(self)
+        metrics.serializing = True
+        started = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializing = False
+
+    serializers.BaseSerializer.data = property(timed_data)
+    _instrumented = True
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {} # (metric name, route, method) -> Histogram
+
+    def observe(self, route, method, metrics):
+        with self.lock:
+            for name, (_, buckets, attribute) in HISTOGRAMS.items():
+                histogram = self.histograms.get((name, route, method))
+                if histogram is None:
+                    histogram = self.histograms[(name, route, method)] = Histogram(buckets)
+                histogram.observe(getattr(metrics, attribute))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def export(self):
+        """ The histograms in the Prometheus text exposition format """
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            counts = {key: (list(histogram.counts), histogram.sum) for key, histogram in histograms}
+        lines = []
+        for name, (help_text, buckets, _) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, route, method), (bucket_counts, total) in counts.items():
+                if metric != name:
+                    continue
+                labels = f'route="{escape_label(route)}",method="{escape_label(method)}"'
+                cumulative = 0
+                for bound, count in zip([*buckets, "+Inf"], bucket_counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {total}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def route_name(request):
+    # url names (product-list, cart-detail ...) keep the number of label values bounded, unmatched urls share one
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.config = metrics_settings()
+        if not self.config["ENABLED"]:
+            raise MiddlewareNotUsed
+        instrument_serializers()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        metrics.total_time = time.perf_counter() - started
+
+        route = route_name(request)
+        registry.observe(route, request.method, metrics)
+        if self.config["SERVER_TIMING"]:
+            response["Server-Timing"] = metrics.server_timing()
+        shape, count = metrics.most_repeated()
+        if self.config["REPEATED_QUERY_WARNING"] and count >= self.config["REPEATED_QUERY_WARNING"]:
+            logger.warning("%s %s (%s) ran the same query %s times: %.200s", request.method, request.path, route, count, shape)
+        return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    return HttpResponse(registry.export(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,233 @@
+import base64
+import datetime
+import json
+from functools import cached_property
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+ESTIMATE_CAP = 10000 # databases without a planner estimate count at most this many rows
+
+
+def estimate_count(queryset):
+    # postgresql: the planner's row estimate for the (filtered) query, no scan at all
+    # others: an exact count capped at ESTIMATE_CAP rows
+    queryset = queryset.order_by()
+    connection = connections[queryset.db] # the database the queryset reads from, not always the default one
+    if connection.vendor == "postgresql":
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return queryset[:ESTIMATE_CAP].count()
+
+
+class EstimatedCountPaginator(Paginator):
+    # pages are sliced straight from the queryset, the estimated count is only informational
+    # so it must never cut a page short or reject a page number
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            number = 0
+        if number < 1:
+            raise NotFound("Invalid page.")
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class EstimatedCountPageNumberPagination(PageNumberPagination):
+    # page number mode for admin tools, ?page=N with an estimated "count" instead of a COUNT(*)
+    django_paginator_class = EstimatedCountPaginator
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # same stable ordering as the keyset mode, so a row never shows up on two pages
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        return super().paginate_queryset(queryset.order_by(*ordering, "pk"), request, view)
+
+    def get_next_link(self):
+        if len(self.page.object_list) < self.page.paginator.per_page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page.number + 1)
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, a cursor needs the exact value to seek from
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the queryset's ordering plus a unique "pk" tiebreaker.
+    The cursor holds the ordering values of the last (or first) row, so the next page is
+    a WHERE (a, pk) > (x, y) seek on the index instead of an OFFSET, and no COUNT(*) is run.
+    Works with any ordering applied before it (OrderingFilter, search rank) on plain fields or annotations.
+    """
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    cursor_query_param = "cursor"
+    ordering = ("pk",) # used when the queryset isn't ordered
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor["reverse"]
+
+        ordering = [self.invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            try:
+                queryset = queryset.filter(self.seek(ordering, cursor["values"]))
+            except (TypeError, ValueError, ValidationError): # tampered cursor values
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        # going forwards there is a previous page whenever we started from a cursor, and the other way round
+        self.has_next = has_more if not reverse else True
+        self.has_previous = cursor is not None if not reverse else has_more
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            ordering = list(self.ordering)
+        pk_name = queryset.model._meta.pk.name
+        ordering = ["pk" if field.lstrip("-") == pk_name else "-pk" if field == f"-{pk_name}" else field for field in ordering]
+        if "pk" not in ordering and "-pk" not in ordering:
+            ordering.append("pk")
+        return ordering
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def seek(ordering, values):
+        # (a > x) OR (a = x AND b > y) OR ..., with < for descending fields
+        condition = Q()
+        for i, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{name}__{lookup}": values[i]})
+            for previous_field, value in zip(ordering[:i], values[:i]):
+                step &= Q(**{previous_field.lstrip("-"): value})
+            condition |= step
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, field.lstrip("-")) for field in self.ordering]
+        payload = json.dumps({"o": self.ordering, "v": values, "r": reverse}, cls=CursorEncoder, separators=(",", ":"))
+        token = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            ordering, values, reverse = payload["o"], payload["v"], bool(payload["r"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor only makes sense for the ordering it was created with
+        if ordering != self.ordering or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return {"values": values, "reverse": reverse}
+
+
+class ProductPagination(BasePagination):
+    # keyset pagination for everyone, ?page=N page numbers (estimated count) opt-in for staff admin tools
+    page_query_param = "page"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param in request.query_params and request.user.is_staff:
+            self.delegate = EstimatedCountPageNumberPagination()
+        else:
+            self.delegate = KeysetPagination()
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.delegate.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return KeysetPagination().get_paginated_response_schema(schema)
+
+
+class ReviewPagination(KeysetPagination):
+    # newest first, seeks on the (product, date_created, id) index
+    page_size = 20
+    max_page_size = 100
+    ordering = ("-date_created", "-pk")
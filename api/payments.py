@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import threading
+import uuid
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError: # httpx is only needed for the async client
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# defaults for settings.PAYMENT_GATEWAY, any key can be overridden there
+PAYMENT_GATEWAY_DEFAULTS = {
+    "BASE_URL": "https://api.flutterwave.com/v3",
+    "CONNECT_TIMEOUT": 3.05, # seconds to open the tcp/tls connection
+    "READ_TIMEOUT": 10, # seconds to wait for the gateway to answer
+    "RETRIES": 2, # retries on connection errors and 502/503/504, never after the request was read
+    "BACKOFF_FACTOR": 0.3, # sleeps 0.3s, 0.6s, 1.2s ... between retries
+    "POOL_SIZE": 10, # keep-alive connections kept open per process
+}
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+def gateway_settings():
+    return {**PAYMENT_GATEWAY_DEFAULTS, **getattr(settings, "PAYMENT_GATEWAY", {})}
+
+
+def build_payment_payload(amount, email, order_id):
+    # tx_ref is generated once per payment so a retried request is recognised by the gateway as the same transaction
+    return {
+        "tx_ref": str(uuid.uuid4()),
+        "amount": str(amount),
+        "currency": "INR",
+        "redirect_url": f"http://localhost:8000/api/orders/confirm_payment/?o_id={order_id}", # formatted string literals
+        "meta": {
+            "consumer_id": 23,
+            "consumer_mac": "92a3-912ba-1192a"
+        },
+        # "max_retry_attempt": 2,
+        "customer": {
+            "email": email,
+            "phonenumber": "080****4528",
+            "name": "Yemi Desola"
+        },
+        "customizations": {
+            "title": "Easy Solution Payments",
+            "logo": "https://marketplace.canva.com/EAFvDRwEHHg/1/0/1600w/canva-colorful-abstract-online-shop-free-logo-cpI8ixEpis8.jpg"
+        }
+    }
+
+
+class PaymentClient:
+    """ Blocking gateway client sharing one pooled keep-alive session per process """
+
+    def __init__(self, config=None):
+        self.config = config or gateway_settings()
+        self.timeout = (self.config["CONNECT_TIMEOUT"], self.config["READ_TIMEOUT"])
+        retry = Retry(
+            total=self.config["RETRIES"],
+            connect=self.config["RETRIES"],
+            read=0, # the gateway may already have processed a request we timed out reading
+            status=self.config["RETRIES"],
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None, # POST included, tx_ref makes the payment request idempotent
+            backoff_factor=self.config["BACKOFF_FACTOR"],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config["POOL_SIZE"], max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {settings.FLW_SEC_KEY}",
+            "Content-Type": "application/json"
+        })
+
+    def create_payment(self, amount, email, order_id):
+        url = f"{self.config['BASE_URL']}/payments"
+        try:
+            response = self.session.post(url, json=build_payment_payload(amount, email, order_id), timeout=self.timeout)
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logger.warning("the payment didn't go through: %s", err)
+            raise PaymentGatewayError(str(err)) from err
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncPaymentClient:
+    """ Non-blocking gateway client for async (ASGI) views, needs httpx """
+
+    def __init__(self, config=None):
+        if httpx is None:
+            raise PaymentGatewayError("httpx must be installed to use AsyncPaymentClient")
+        self.config = config or gateway_settings()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.config["READ_TIMEOUT"], connect=self.config["CONNECT_TIMEOUT"]),
+            limits=httpx.Limits(max_connections=self.config["POOL_SIZE"], max_keepalive_connections=self.config["POOL_SIZE"]),
+            headers={"Authorization": f"Bearer {settings.FLW_SEC_KEY}"},
+        )
+
+    async def create_payment(self, amount, email, order_id):
+        url = f"{self.config['BASE_URL']}/payments"
+        payload = build_payment_payload(amount, email, order_id)
+        retries = self.config["RETRIES"]
+        for attempt in range(retries + 1):
+            try:
+                response = await self.client.post(url, json=payload)
+            except httpx.ConnectError as err: # nothing reached the gateway, safe to retry
+                error = err
+            except httpx.HTTPError as err:
+                logger.warning("the payment didn't go through: %s", err)
+                raise PaymentGatewayError(str(err)) from err
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    try:
+                        return response.json()
+                    except ValueError as err:
+                        raise PaymentGatewayError(str(err)) from err
+                error = PaymentGatewayError(f"gateway returned {response.status_code}")
+            if attempt < retries:
+                await asyncio.sleep(self.config["BACKOFF_FACTOR"] * (2 ** attempt))
+        logger.warning("the payment didn't go through: %s", error)
+        raise PaymentGatewayError(str(error)) from error
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_payment_client():
+    # one client per process so every request worker reuses the same connection pool
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaymentClient()
+    return _client
+
+
+def reset_payment_client():
+    # used when settings.PAYMENT_GATEWAY changes (e.g. in tests or benchmarks)
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
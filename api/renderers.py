@@ -0,0 +1,31 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError: # optional, JSONRenderer is used without it
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same bytes (compact, utf-8, U+2028 / U+2029 escaped) with orjson,
+    several times faster on large lists. Floats only differ in exponent notation (1e16 vs 1e+16), which
+    api values don't reach. Falls back to JSONRenderer when orjson isn't installed or an indented
+    response is asked for (Accept: application/json; indent=4).
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # uuids and str / dict / list subclasses are native, datetimes, decimals, lazy strings... go through
+        # DRF's encoder so they're formatted exactly like JSONRenderer does
+        try:
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError: # e.g. integers over 64 bits, json handles them
+            return super().render(data, accepted_media_type, renderer_context)
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret: # U+2028 / U+2029
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
@@ -1,6 +1,11 @@
 from rest_framework import serializers
-from storeapp.models import Product, Category, Review, Cart, Cartitems, ProductImage, Profile, Order, OrderItem
+from storeapp.models import Product, Category, Review, Cart, Cartitems, ProductImage, Profile, Order, OrderItem, Reservation, InsufficientStock, MAX_CART_QUANTITY, QuantityLimitExceeded
 from django.db import transaction
+from storeapp.images import save_product_images
+from .cache import bump_generation
+from .deals import schedule_rebuild
+from .fastpath import CompiledReadMixin
+from .fieldsets import SparseFieldsetMixin
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,10 +13,29 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["category_id", "title", "slug"]
 
 
+class CategoryReadSerializer(serializers.ModelSerializer):
+    # needs Category.objects.with_counts()
+    product_count = serializers.IntegerField(read_only=True)
+    discounted_count = serializers.IntegerField(read_only=True)
+    in_stock_count = serializers.IntegerField(read_only=True)
+    featured_product = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Category
+        fields = ["category_id", "title", "slug", "icon", "product_count", "discounted_count", "in_stock_count", "featured_product"]
+
+    def get_featured_product(self, category):
+        product = category.featured_product
+        if product is None:
+            return None
+        return {"id": product.id, "name": product.name, "slug": product.slug, "price": product.price}
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ["id", "product", "image"]
+        fields = ["id", "product", "image", "thumbnail", "webp"] # list pages should use thumbnail, null until it's rendered
+        read_only_fields = ["thumbnail", "webp"]
 
 
 class ProductSerilaizer(serializers.ModelSerializer):
@@ -35,19 +59,33 @@ class ProductSerilaizer(serializers.ModelSerializer):
     def create(self, validated_data): # def create customize the behavior of creating a new instance
         uploaded_images = validated_data.pop("uploaded_images")
         product = Product.objects.create(**validated_data)
-        for uploaded_image in uploaded_images:
-            ProductImage.objects.create(product=product, image=uploaded_image)
+        # originals are stored right away (deduplicated by content), thumbnails are rendered by a worker process after commit
+        save_product_images(product, uploaded_images)
         return product
 
 
-class ProductReadSerializer(ProductSerilaizer):
+class ProductReadSerializer(SparseFieldsetMixin, CompiledReadMixin, ProductSerilaizer): # ?fields= / ?expand= (api/fieldsets.py), compiled read path (api/fastpath.py)
     category = CategorySerializer(read_only=True)
+    collapsed_fields = {
+        "category": serializers.PrimaryKeyRelatedField(read_only=True),
+        "images": serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+    }
+    available = serializers.SerializerMethodField() # inventory not held by other carts' reservations
+
+    class Meta(ProductSerilaizer.Meta):
+        fields = ProductSerilaizer.Meta.fields + ["available", "review_count", "last_reviewed_at"]
+
+    def get_available(self, product):
+        # annotated by Product.objects.with_available()
+        if hasattr(product, "available"):
+            return product.available
+        return Product.objects.with_available().values_list("available", flat=True).get(pk=product.pk)
 
 
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ["id", "name", "description"]
+        fields = ["id", "name", "description", "date_created"]
 
     def create(self, validated_data):
         product_id = self.context["product"]
@@ -70,6 +108,9 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     def get_sub_total(self, obj):
         # print(obj)
+        # sub_total is annotated by Cartitems.objects.with_sub_total(), fall back to python for plain instances
+        if hasattr(obj, "sub_total"):
+            return obj.sub_total
         return obj.quantity * obj.product.price
 
 
@@ -78,6 +119,7 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cartitems
         fields = ["id", "product", "quantity"]
+        extra_kwargs = {"product": {"required": True, "allow_null": False}}
 
     # the below commented code is to check if product id exists or not it is used when we mention product_id instead of product in fields array,
     # but here in this case drf automatically handles this
@@ -89,22 +131,19 @@ class AddCartItemSerializer(serializers.ModelSerializer):
     # the below save method is used to check whether the item is already present in cart, if it is add the quantity or else create one
     def save(self, **kwargs):
         cart_id = self.context["cart_id"]
-        product_id = self.validated_data["product"]
-        quantity = self.validated_data["quantity"]
+        product = self.validated_data["product"]
+        quantity = self.validated_data.get("quantity", 0)
 
+        # one INSERT ... ON CONFLICT DO UPDATE, so two concurrent adds of the same product can't lose an increment
         try:
-            cartitem = Cartitems.objects.get(product=product_id, cart=cart_id)
-            cartitem.quantity += quantity
-            cartitem.save()
-            self.instance = cartitem
-
-        except:
-            self.instance = Cartitems.objects.create(cart_id=cart_id, **self.validated_data)
+            self.instance = Cartitems.objects.add_quantity(cart_id, product.pk, quantity)
+        except QuantityLimitExceeded:
+            raise serializers.ValidationError({"quantity": [f"The cart can't hold more than {MAX_CART_QUANTITY} of this product."]})
         
         # print(self.instance)
         return self.instance
     
-    # if we not assign the cartitems to self.instance in both try and except it will return the data we entered that is product and quantity
+    # if we not assign the cartitems to self.instance it will return the data we entered that is product and quantity
     # whereas in above case it will return id, product and updated quantity
 
     # in modelserializer def save method returns self.instance so self.instance is used above
@@ -115,33 +154,111 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ["quantity"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartItemOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=["add", "set", "remove"]) # add to, set or remove the quantity of a product
+    product = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=0, max_value=MAX_CART_QUANTITY, required=False)
+
+    def validate(self, data):
+        if data["op"] != "remove" and "quantity" not in data:
+            raise serializers.ValidationError({"quantity": ["This field is required."]})
+        return data
+
+
+class CartItemBatchSerializer(serializers.Serializer):
+    operations = CartItemOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_operations(self, operations):
+        # every product of the batch is checked in one query
+        product_ids = {operation["product"] for operation in operations}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list("id", flat=True))
+        missing = product_ids - found
+        if missing:
+            raise serializers.ValidationError([f"There is no product associated with the given ID {product_id}" for product_id in sorted(map(str, missing))])
+        return operations
+
+    def save(self, **kwargs):
+        cart_id = self.context["cart_id"]
+
+        # fold the operations, in order, into one change per product: an increment ("add") or a final quantity ("set")
+        changes = {}
+        for operation in self.validated_data["operations"]:
+            product_id = operation["product"]
+            kind, quantity = changes.get(product_id, ("add", 0))
+            if operation["op"] == "add":
+                changes[product_id] = (kind, quantity + operation["quantity"])
+            elif operation["op"] == "set":
+                changes[product_id] = ("set", operation["quantity"])
+            else:
+                changes[product_id] = ("set", 0)
+
+        folded_over = sorted(str(product_id) for product_id, (kind, quantity) in changes.items() if quantity > MAX_CART_QUANTITY)
+        if folded_over:
+            raise serializers.ValidationError({"operations": [f"More than {MAX_CART_QUANTITY} of product {product_id} in one batch" for product_id in folded_over]})
+
+        removed = [product_id for product_id, (kind, quantity) in changes.items() if kind == "set" and quantity == 0]
+        quantities = {product_id: quantity for product_id, (kind, quantity) in changes.items() if kind == "set" and quantity > 0}
+        increments = {product_id: quantity for product_id, (kind, quantity) in changes.items() if kind == "add" and quantity > 0}
+
+        # at most three statements whatever the size of the batch
+        with transaction.atomic():
+            if removed:
+                Cartitems.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+            if quantities:
+                Cartitems.objects.bulk_create(
+                    [Cartitems(cart_id=cart_id, product_id=product_id, quantity=quantity) for product_id, quantity in quantities.items()],
+                    update_conflicts=True,
+                    unique_fields=["cart", "product"],
+                    update_fields=["quantity"],
+                )
+            if increments:
+                try:
+                    Cartitems.objects.add_quantities(cart_id, increments)
+                except QuantityLimitExceeded as err: # the whole batch is rolled back
+                    raise serializers.ValidationError({"operations": [
+                        f"The cart can't hold more than {MAX_CART_QUANTITY} of product {product_id}" for product_id in sorted(map(str, err.product_ids))
+                    ]})
+        return Cart.objects.with_totals().get(pk=cart_id)
+
+
+class CartSerializer(SparseFieldsetMixin, CompiledReadMixin, serializers.ModelSerializer):
     # id = serializers.UUIDField(read_only = True) # in utube tut id is expected while creating so they added this line but here it is cretaing without it so commented
     items = CartItemSerializer(many=True, read_only=True) # without this line items field will return only all the ids
     total = serializers.SerializerMethodField(method_name="main_total")
+    collapsed_fields = {"items": serializers.PrimaryKeyRelatedField(many=True, read_only=True)}
 
     class Meta:
         model = Cart
         fields = ["id", "items", "total"]
     
     def main_total(self, cart: Cart): # cart: Cart => Ensures cart is expected to be an instance of the Cart model. (is called type annotation)
+        # cart_total is annotated by Cart.objects.with_totals(), a freshly created cart has no annotation
+        if hasattr(cart, "cart_total"):
+            return cart.cart_total
         items = cart.items.all()
         total = sum([item.quantity * item.product.price for item in items])
         return total
 
 
+class ReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Reservation
+        fields = ["product", "quantity", "expires_at"]
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
     class Meta:
         model = OrderItem
-        fields = ["id", "product", "quantity"]
+        fields = ["id", "product", "quantity", "unit_price"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, CompiledReadMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
+    collapsed_fields = {"items": serializers.PrimaryKeyRelatedField(many=True, read_only=True)}
     class Meta:
         model = Order
-        fields = ["id", "placed_at", "pending_status", "owner", "items"]
+        fields = ["id", "placed_at", "pending_status", "owner", "items", "total_price"]
 
 
 class CreateOrderSerializer(serializers.Serializer):
@@ -151,14 +268,31 @@ class CreateOrderSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data["cart_id"]
             user_id = self.context["user_id"]
-            order = Order.objects.create(owner_id=user_id)
-            cart_items = Cartitems.objects.filter(cart=cart_id)
+            cart_items = list(Cartitems.objects.filter(cart=cart_id, product__isnull=False).select_related("product"))
+            if not cart_items:
+                raise serializers.ValidationError({"cart_id": ["The cart is empty."]})
+
+            # locks the products in a fixed order and decrements their inventory, nothing is ordered when one is short
+            try:
+                Product.objects.take_stock({item.product_id: item.quantity for item in cart_items}, cart_id=cart_id)
+            except InsufficientStock as err:
+                names = {item.product_id: item.product.name for item in cart_items}
+                raise serializers.ValidationError({"cart_id": [
+                    f"Only {available} left of {names[product_id]}" for product_id, available in err.shortages.items()
+                ]})
+            bump_generation("products", "categories") # inventory changed without post_save
+            transaction.on_commit(schedule_rebuild) # deals show the available stock
+
             order_items = [OrderItem(
-                                    order=order, 
                                     product=item.product, 
-                                    quantity=item.quantity
+                                    quantity=item.quantity,
+                                    unit_price=item.product.price # price is frozen here, later price changes don't affect the order
                                 ) 
                         for item in cart_items]
+            total_price = sum([item.unit_price * item.quantity for item in order_items])
+            order = Order.objects.create(owner_id=user_id, total_price=total_price)
+            for order_item in order_items:
+                order_item.order = order
             OrderItem.objects.bulk_create(order_items)
             # bulk_create method inserts the provided list of objects into the database in an efficient manner (generally only 1 query, no matter how many objects there are)
             # Cart.objects.filter(id=cart_id).delete()
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.settings import api_settings
+
+from storeapp.models import Category, Product, ProductImage, Review
+from storeapp.reservations import reservations_changed
+from .authentication import forget_user
+from .cache import bump_generation, invalidation_deferred, on_commit_once, remember_holds
+from .deals import schedule_rebuild
+
+# invalidate the cached catalog responses (cache.py) whenever the data behind them changes
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver(reservations_changed) # products show their available (not reserved) stock
+def invalidate_products(sender, **kwargs):
+    if invalidation_deferred():
+        return
+    bump_generation("products", "categories") # categories show product counts and their featured product
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_categories(sender, **kwargs):
+    bump_generation("categories", "products") # products embed their category
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_reviews(sender, instance, **kwargs):
+    bump_generation(f"reviews:{instance.product_id}", "products") # products show their review counters
+
+
+@receiver(reservations_changed)
+def track_holds(sender, **kwargs):
+    remember_holds() # the earliest expiry, see HOLDS_KEY in cache.py
+
+
+# the deals snapshots (deals.py) show products with their category, images, review counters and available stock
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Review)
+@receiver(reservations_changed)
+def refresh_deals(sender, **kwargs):
+    if invalidation_deferred():
+        return
+    on_commit_once("deals", lambda: schedule_rebuild())
+
+
+# the users cached by CachedJWTAuthentication (authentication.py), password changes and deactivation are saves too
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def invalidate_user(sender, instance, **kwargs):
+    forget_user(getattr(instance, api_settings.USER_ID_FIELD))
@@ -1,3 +1,1206 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from datetime import timedelta
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import User
+from django.utils import timezone
+from storeapp.models import Cart, Cartitems, Category, Order, OrderItem, Product, ProductImage, Reservation, Review
+from storeapp.reservations import release_expired
+from .authentication import CachedJWTAuthentication, forget_user, local_users
+from .cache import get_cache, get_generation
+from .deals import FEEDS, snapshot_key
+from .management.commands.bench_api import SCENARIOS
+from .management.commands.explain_endpoints import sequential_scans
+from .management.commands.fake_gateway import make_fake_gateway
+from .metrics import RequestMetrics, registry, sql_shape
+from .payments import reset_payment_client
+from .renderers import ORJSONRenderer
+from .serializers import CartSerializer, OrderSerializer, ProductReadSerializer
 
 # Create your tests here.
+
+# deals rebuilds (api/deals.py) run right away in the thread that commits, a debounce timer started by one
+# test's on_commit callbacks would fire during a later test and query its database
+no_debounce = override_settings(DEALS={**settings.DEALS, "DEBOUNCE": 0})
+
+
+def setUpModule():
+    no_debounce.enable()
+
+
+def tearDownModule():
+    no_debounce.disable()
+
+
+class ProductQueryCountTests(TestCase):
+    # the product read path must cost the same number of queries whatever the page size:
+    # 1 for products joined with their category + 1 for all their images
+    def setUp(self):
+        self.client = APIClient()
+        self.categories = [Category.objects.create(title=f"Category {i}", slug=f"category-{i}") for i in range(3)]
+        self.products = []
+        for i in range(20):
+            product = Product.objects.create(
+                name=f"Product {i}",
+                description=f"description {i}",
+                old_price=100 + i,
+                category=self.categories[i % 3],
+                discount=i % 2 == 0,
+            )
+            ProductImage.objects.create(product=product, image=f"img/{i}-a.jpg")
+            ProductImage.objects.create(product=product, image=f"img/{i}-b.jpg")
+            self.products.append(product)
+
+    def test_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertEqual(len(response.data["results"][0]["images"]), 2)
+        self.assertIn("title", response.data["results"][0]["category"])
+
+    def test_retrieve(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/products/{self.products[0].id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["category"]["slug"], "category-0")
+
+    def test_search(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/products/", {"search": "description 1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(len(response.data["results"]) > 0)
+
+    def test_filter(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/products/", {
+                "category_id": self.categories[0].category_id,
+                "old_price__gt": 105,
+                "ordering": "-old_price",
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(p["category"]["slug"] == "category-0" for p in response.data["results"]))
+
+
+class CartTotalTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        for i in range(50):
+            product = Product.objects.create(name=f"Product {i}", old_price=10 + i, discount=i % 3 == 0)
+            Cartitems.objects.create(cart=self.cart, product=product, quantity=i % 4 + 1)
+
+    def test_retrieve_cart_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/carts/{self.cart.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 50)
+
+    def test_totals_match_python_prices(self):
+        response = self.client.get(f"/api/carts/{self.cart.id}/")
+        items = Cartitems.objects.filter(cart=self.cart).select_related("product")
+        expected = {str(item.id): item.quantity * item.product.price for item in items}
+        for item in response.data["items"]:
+            self.assertAlmostEqual(item["sub_total"], expected[str(item["id"])])
+        self.assertAlmostEqual(response.data["total"], sum(expected.values()))
+
+    def test_empty_cart_total(self):
+        cart = Cart.objects.create()
+        response = self.client.get(f"/api/carts/{cart.id}/")
+        self.assertEqual(response.data["total"], 0)
+
+
+class OrderTotalTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="buyer@example.com", password="secret-pass-123")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+        self.discounted = Product.objects.create(name="Discounted", old_price=200, discount=True)
+        self.regular = Product.objects.create(name="Regular", old_price=50)
+        Cartitems.objects.create(cart=self.cart, product=self.discounted, quantity=2)
+        Cartitems.objects.create(cart=self.cart, product=self.regular, quantity=3)
+
+    def test_total_is_frozen_at_checkout(self):
+        response = self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(owner=self.user)
+        self.assertAlmostEqual(order.total_price, 2 * 140 + 3 * 50)
+
+        Product.objects.filter(pk=self.regular.pk).update(old_price=500)
+        order.refresh_from_db()
+        self.assertAlmostEqual(order.total_price, 2 * 140 + 3 * 50)
+        self.assertEqual(sorted(order.items.values_list("unit_price", flat=True)), [50, 140])
+
+    def test_list_query_count(self):
+        for _ in range(5):
+            self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        with self.assertNumQueries(2): # orders, then order items joined with their products
+            response = self.client.get("/api/orders/")
+        self.assertEqual(response.status_code, 200)
+
+
+class CheckoutStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="stock@example.com", password="secret-pass-123")
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create()
+        self.first = Product.objects.create(name="First", old_price=10, inventory=5)
+        self.second = Product.objects.create(name="Second", old_price=10, inventory=2)
+        Cartitems.objects.create(cart=self.cart, product=self.first, quantity=3)
+        Cartitems.objects.create(cart=self.cart, product=self.second, quantity=2)
+
+    def test_checkout_decrements_inventory(self):
+        response = self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        self.assertEqual(response.status_code, 201)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.inventory, self.second.inventory), (2, 0))
+
+    def test_short_product_rejects_the_whole_order(self):
+        self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        response = self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data["cart_id"]), 2)
+        self.assertEqual(Order.objects.count(), 1)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.inventory, 2) # nothing taken from the product that had enough
+
+    def test_empty_cart(self):
+        response = self.client.post("/api/orders/", {"cart_id": str(Cart.objects.create().id)})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+@skipUnlessDBFeature("has_select_for_update") # sqlite's deferred transactions fail with "database is locked" instead of waiting
+class ConcurrentCheckoutTests(TransactionTestCase):
+    threads = 8
+
+    def test_no_oversell(self):
+        user = User.objects.create_user(email="rush@example.com", password="secret-pass-123")
+        product = Product.objects.create(name="Flash sale", old_price=10, inventory=5)
+        carts = []
+        for _ in range(self.threads * 2):
+            cart = Cart.objects.create()
+            Cartitems.objects.create(cart=cart, product=product, quantity=1)
+            carts.append(cart)
+        statuses = []
+        start = threading.Barrier(self.threads)
+
+        def checkout(carts):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                start.wait()
+                for cart in carts:
+                    statuses.append(client.post("/api/orders/", {"cart_id": str(cart.id)}).status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=(carts[i::self.threads],)) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.inventory, 0)
+        self.assertEqual(statuses.count(201), 5)
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(statuses.count(400), len(carts) - 5)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="flash@example.com", password="secret-pass-123")
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True): # no deals rebuild left pending
+            self.product = Product.objects.create(name="Flash", old_price=10, inventory=5, flash_sales=True)
+            self.regular = Product.objects.create(name="Regular", old_price=10, inventory=5)
+        self.cart = self.cart_with(3)
+        Cartitems.objects.create(cart=self.cart, product=self.regular, quantity=1)
+
+    def cart_with(self, quantity):
+        cart = Cart.objects.create()
+        Cartitems.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return cart
+
+    def reserve(self, cart):
+        return self.client.post(f"/api/carts/{cart.id}/reservation/")
+
+    def available(self, product):
+        return self.client.get(f"/api/products/{product.id}/").data["available"]
+
+    def test_reservation_holds_flash_sale_stock(self):
+        response = self.reserve(self.cart)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item["product"], item["quantity"]) for item in response.data], [(self.product.id, 3)])
+        self.assertEqual(self.available(self.product), 2)
+        self.assertEqual(self.available(self.regular), 5) # only flash sale products are held
+
+        other = self.cart_with(3)
+        response = self.reserve(other)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["products"], [{"product": self.product.id, "available": 2}])
+        response = self.client.post("/api/orders/", {"cart_id": str(other.id)})
+        self.assertEqual(response.status_code, 400)
+
+        # the holder checks out against its own reservation, which is consumed
+        response = self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(self.available(self.product), 2)
+
+    def test_reserving_again_renews(self):
+        self.reserve(self.cart)
+        Cartitems.objects.filter(cart=self.cart, product=self.product).update(quantity=4)
+        self.reserve(self.cart)
+        self.assertEqual(list(Reservation.objects.values_list("quantity", flat=True)), [4])
+
+        self.client.delete(f"/api/carts/{self.cart.id}/reservation/")
+        self.assertEqual(self.available(self.product), 5)
+
+    def test_expired_reservations_are_released(self):
+        self.reserve(self.cart)
+        for _ in range(2):
+            self.reserve(self.cart_with(1))
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.available(self.product), 5) # expired ones stop counting before the sweep
+        live = self.cart_with(1)
+        self.reserve(live)
+
+        self.assertEqual(release_expired(batch_size=2), 3)
+        self.assertEqual(list(Reservation.objects.values_list("cart", flat=True)), [live.id])
+
+    def test_malformed_cart_id(self):
+        self.assertEqual(self.client.post("/api/carts/not-a-uuid/reservation/").status_code, 404)
+
+    def test_cached_products_follow_an_expiry(self):
+        with override_settings(RESERVATIONS={**settings.RESERVATIONS, "TTL": 0.5}), self.captureOnCommitCallbacks(execute=True):
+            self.reserve(self.cart)
+        self.assertEqual(self.available(self.product), 2)
+        self.assertEqual(self.client.get("/api/deals/flash-sales/").data["results"][0]["available"], 2)
+        time.sleep(0.6) # no write, no sweep
+        with self.captureOnCommitCallbacks(execute=True): # the deals rebuild runs after commit
+            self.assertEqual(self.available(self.product), 5)
+        self.assertEqual(self.client.get("/api/deals/flash-sales/").data["results"][0]["available"], 5)
+
+
+class ReviewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Lamp")
+        self.url = f"/api/products/{self.product.id}/reviews/"
+
+    def test_counters_follow_creates_and_deletes(self):
+        ids = [self.client.post(self.url, {"name": f"reader {i}", "description": "nice"}).data["id"] for i in range(3)]
+        product = self.client.get(f"/api/products/{self.product.id}/").data
+        self.assertEqual(product["review_count"], 3)
+        latest = Review.objects.get(pk=ids[-1]).date_created
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.last_reviewed_at, latest)
+
+        self.client.delete(f"{self.url}{ids[-1]}/")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, 2)
+        self.assertEqual(self.product.last_reviewed_at, Review.objects.get(pk=ids[1]).date_created)
+        self.assertEqual(self.client.get(f"/api/products/{self.product.id}/").data["review_count"], 2)
+
+    def test_bulk_deletes_recount_once(self):
+        other = Product.objects.create(name="Desk")
+        for i in range(3):
+            Review.objects.create(product=self.product, name=f"reader {i}")
+            Review.objects.create(product=other, name=f"reader {i}")
+        kept = Review.objects.create(product=other, name="kept")
+        with self.assertNumQueries(6): # savepoint, product ids, select, delete, recount, release (no query per review)
+            Review.objects.exclude(pk=kept.pk).delete()
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.last_reviewed_at), (0, None))
+        self.assertEqual((other.review_count, other.last_reviewed_at), (1, kept.date_created))
+
+    def test_product_delete_skips_the_counters(self):
+        for i in range(20):
+            Review.objects.create(product=self.product, name=f"reader {i}")
+        with CaptureQueriesContext(connection) as queries:
+            self.product.delete()
+        self.assertFalse(Review.objects.exists())
+        self.assertFalse([query["sql"] for query in queries if query["sql"].startswith("UPDATE")])
+
+    def test_keyset_pages_newest_first(self):
+        reviews = [Review.objects.create(product=self.product, name=f"reader {i}") for i in range(25)]
+        Review.objects.create(product=Product.objects.create(name="Other"), name="elsewhere")
+        seen, url = [], f"{self.url}?page_size=10"
+        while url:
+            with self.assertNumQueries(1):
+                page = self.client.get(url).data
+            seen += [review["id"] for review in page["results"]]
+            url = page["next"]
+        self.assertEqual(seen, [review.id for review in reversed(reviews)])
+
+
+class CategoryListingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.categories = [Category.objects.create(title=f"Category {i}", slug=f"category-{i}") for i in range(4)]
+        for i, category in enumerate(self.categories):
+            for j in range(i + 1):
+                Product.objects.create(name=f"Product {i}.{j}", category=category, old_price=100, discount=j % 2 == 0, inventory=j)
+            category.featured_product = category.products.first()
+            category.save()
+
+    def test_counts_and_featured_product_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/categories/")
+        last = response.data[-1]
+        self.assertEqual((last["product_count"], last["discounted_count"], last["in_stock_count"]), (4, 2, 3))
+        featured = self.categories[-1].featured_product
+        self.assertEqual(last["featured_product"], {"id": featured.id, "name": featured.name, "slug": None, "price": featured.price})
+
+    def test_nav_document(self):
+        first = self.client.get("/api/categories/nav/")
+        self.assertEqual([category["title"] for category in first.data["categories"]], [category.title for category in self.categories])
+        with self.assertNumQueries(0):
+            cached = self.client.get("/api/categories/nav/")
+        self.assertEqual(cached.data, first.data)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/categories/nav/", HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+
+        Product.objects.create(name="New", category=self.categories[0])
+        response = self.client.get("/api/categories/nav/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data["version"], first.data["version"])
+        self.assertEqual(response.data["categories"][0]["product_count"], 2)
+
+
+class FastPathTests(TestCase):
+    # the compiled read path and the orjson renderer must produce exactly the bytes of DRF's serializers and JSONRenderer
+    def setUp(self):
+        self.user = User.objects.create_user(email="fast@example.com", password="secret-pass-123")
+        category = Category.objects.create(title="Lamps", slug="lamps")
+        for i in range(3):
+            product = Product.objects.create(name=f"Lamp {i} ünïcode", description=None if i else "line\u2028break",
+                                             old_price=19.99 + i, discount=i == 1, category=category if i else None)
+            ProductImage.objects.create(product=product, image=f"img/lamp {i}.jpg", thumbnail=f"img/thumbnails/lamp-{i}.jpg" if i else None)
+            Review.objects.create(product=product, name="reader")
+        self.cart = Cart.objects.create()
+        for product in Product.objects.all():
+            Cartitems.objects.create(cart=self.cart, product=product, quantity=2)
+        order = Order.objects.create(owner=self.user, total_price=12.5)
+        OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=13.99)
+        self.request = Request(APIRequestFactory().get("/api/products/"))
+
+    def assertSameBytes(self, serializer_class, instance, many=False):
+        reference = type("Reference", (serializer_class,), {"compiled_representation": False})
+        context = {"request": self.request}
+        expected = JSONRenderer().render(reference(instance, many=many, context=context).data)
+        self.assertEqual(ORJSONRenderer().render(serializer_class(instance, many=many, context=context).data), expected)
+
+    def test_products(self):
+        queryset = Product.objects.select_related("category").prefetch_related("images").with_available()
+        self.assertSameBytes(ProductReadSerializer, queryset, many=True)
+        self.assertSameBytes(ProductReadSerializer, Product.objects.first()) # no annotation, no prefetch
+
+    def test_cart_and_orders(self):
+        self.assertSameBytes(CartSerializer, Cart.objects.with_totals().get())
+        self.assertSameBytes(CartSerializer, self.cart)
+        self.assertSameBytes(OrderSerializer, Order.objects.prefetch_related("items__product"), many=True)
+
+    def test_renderer(self):
+        data = {"text": "é \u2028 \u2029", "when": timezone.now(), "price": Decimal("1.10"), "id": uuid.uuid4(), 1: [None, True, 0.1]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(data, "application/json; indent=4"), JSONRenderer().render(data, "application/json; indent=4"))
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="sparse@example.com", password="secret-pass-123")
+        self.category = Category.objects.create(title="Desks", slug="desks")
+        self.cart = Cart.objects.create()
+        for i in range(5):
+            product = Product.objects.create(name=f"Desk {i}", description="solid oak " * 50, old_price=100 + i,
+                                             discount=i % 2 == 0, category=self.category)
+            ProductImage.objects.create(product=product, image=f"img/desk-{i}.jpg")
+            Cartitems.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_default_output_unchanged(self):
+        product = self.client.get("/api/products/").data["results"][0]
+        self.assertIn("description", product)
+        self.assertIn("title", product["category"])
+        self.assertIn("image", product["images"][0])
+
+    def test_selected_fields_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/products/", {"fields": "id,name,price"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1) # no join, no images prefetch, no reservations subquery
+        self.assertNotIn("description", queries[0]["sql"])
+        product = response.data["results"][0]
+        self.assertEqual(set(product), {"id", "name", "price"})
+        self.assertAlmostEqual(product["price"], Product.objects.get(pk=product["id"]).price)
+
+    def test_collapsed_and_expanded_relations(self):
+        with CaptureQueriesContext(connection) as queries:
+            product = self.client.get("/api/products/", {"fields": "id,category,images"}).data["results"][0]
+        self.assertNotIn("JOIN", queries[0]["sql"])
+        self.assertEqual(product["category"], self.category.pk)
+        self.assertEqual(len(product["images"]), 1)
+        self.assertIsInstance(product["images"][0], int)
+
+        product = self.client.get("/api/products/", {"fields": "id", "expand": "category,images"}).data["results"][0]
+        self.assertEqual(set(product), {"id", "category", "images"})
+        self.assertEqual(product["category"]["slug"], "desks")
+        self.assertIn("image", product["images"][0])
+
+    def test_cart(self):
+        expected = self.client.get(f"/api/carts/{self.cart.id}/").data["total"]
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/carts/{self.cart.id}/", {"fields": "id,total"})
+        self.assertEqual(set(response.data), {"id", "total"})
+        self.assertAlmostEqual(response.data["total"], expected)
+
+        data = self.client.get(f"/api/carts/{self.cart.id}/", {"fields": "items"}).data
+        self.assertEqual(sorted(data["items"]), sorted(self.cart.items.values_list("id", flat=True)))
+
+    def test_orders(self):
+        self.client.force_authenticate(self.user)
+        self.client.post("/api/orders/", {"cart_id": str(self.cart.id)})
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/orders/", {"fields": "id,total_price"})
+        self.assertEqual(set(response.data[0]), {"id", "total_price"})
+        order = self.client.get("/api/orders/", {"fields": "id", "expand": "items"}).data[0]
+        self.assertEqual(len(order["items"]), 5)
+        self.assertIn("product", order["items"][0])
+
+
+@override_settings(METRICS={"ENABLED": True, "SERVER_TIMING": True})
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        for i in range(4):
+            product = Product.objects.create(name=f"Chair {i}", old_price=20 + i)
+            ProductImage.objects.create(product=product, image=f"img/chair-{i}.jpg")
+
+    def test_server_timing(self):
+        response = self.client.get("/api/products/")
+        timing = response["Server-Timing"]
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="2 queries, 0 repeated"', timing)
+        self.assertIn("serializer;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_repeated_queries(self):
+        self.assertEqual(sql_shape("SELECT 1 WHERE id IN (%s, %s, %s)"), sql_shape("SELECT 1 WHERE id IN (%s, %s)"))
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for product in Product.objects.all():
+                list(product.images.all()) # N+1
+        self.assertEqual(metrics.queries, 5)
+        self.assertEqual(metrics.repeated, 3)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.get("/api/products/")
+        self.assertIn(self.client.get("/metrics/").status_code, (401, 403))
+        self.client.force_authenticate(User.objects.create_user(email="ops@example.com", password="secret-pass-123", is_staff=True))
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{route="product-list",method="GET",le="+Inf"} 1', text)
+        self.assertIn('http_request_queries_bucket{route="product-list",method="GET",le="2"} 1', text)
+        self.assertIn('http_request_queries_bucket{route="product-list",method="GET",le="1"} 0', text)
+
+    @override_settings(METRICS={"ENABLED": False})
+    def test_disabled(self):
+        response = APIClient().get("/api/products/")
+        self.assertNotIn("Server-Timing", response)
+        self.assertNotIn("product-list", registry.export())
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        local_users.clear()
+        self.user = User.objects.create_user(email="cached@example.com", password="secret-pass-123", first_name="Ada")
+        self.token = AccessToken.for_user(self.user)
+
+    def authenticate(self):
+        request = Request(APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"JWT {self.token}"))
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_user_is_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.email, user.first_name), (self.user.pk, "cached@example.com", "Ada"))
+        user.first_name = "Changed" # each request gets its own instance
+        self.assertEqual(self.authenticate().first_name, "Ada")
+        with self.assertNumQueries(1): # not cached, loaded on access
+            self.assertTrue(user.check_password("secret-pass-123"))
+
+    def test_shared_layer_only_with_a_shared_cache(self):
+        self.authenticate()
+        local_users.clear() # another worker: with locmem it has its own cache
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with override_settings(AUTH_CACHE={"SHARED": True}):
+            local_users.clear()
+            self.authenticate()
+            local_users.clear()
+            with self.assertNumQueries(0):
+                self.authenticate()
+        cached = [value for value in get_cache()._cache.values()]
+        self.assertFalse(any(self.user.password.encode() in value for value in cached)) # only a digest of the hash
+
+    def test_saves_invalidate(self):
+        self.authenticate()
+        self.user.first_name = "Grace"
+        self.user.set_password("other-pass-456")
+        self.user.save()
+        user = self.authenticate()
+        self.assertEqual(user.first_name, "Grace")
+        self.assertTrue(user.check_password("other-pass-456"))
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_update_needs_forget_user(self):
+        self.authenticate()
+        User.objects.filter(pk=self.user.pk).update(first_name="Updated")
+        self.assertEqual(self.authenticate().first_name, "Ada") # no signal for queryset updates
+        forget_user(self.user.pk)
+        self.assertEqual(self.authenticate().first_name, "Updated")
+
+    def test_deleted_user(self):
+        self.authenticate()
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_api_requests(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"JWT {self.token}")
+        self.assertEqual(client.get("/auth/users/me/").data["email"], "cached@example.com")
+        self.assertEqual(client.get("/api/orders/").status_code, 200)
+        client.credentials(HTTP_AUTHORIZATION="JWT not-a-token")
+        self.assertEqual(client.get("/api/orders/").status_code, 401)
+
+    def test_bench_auth(self):
+        out = io.StringIO()
+        call_command("bench_auth", requests=20, users=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ["cached-shared", "jwt", "cached"]) # locmem isn't shared
+        self.assertIn("1.000 queries/request", lines[1])
+        self.assertIn("0.100 queries/request (18 saved)", lines[2]) # one load per user
+        self.assertEqual(User.objects.count(), 1)
+
+
+class PaymentGatewayTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email="payer@example.com", password="secret-pass-123")
+        self.client.force_authenticate(self.user)
+        self.order = Order.objects.create(owner=self.user, total_price=420)
+
+    def start_gateway(self, **kwargs):
+        server = make_fake_gateway(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(reset_payment_client)
+        reset_payment_client()
+        host, port = server.server_address[:2]
+        return f"http://{host}:{port}/v3"
+
+    def test_pay(self):
+        base_url = self.start_gateway()
+        with override_settings(PAYMENT_GATEWAY={"BASE_URL": base_url}):
+            response = self.client.post(f"/api/orders/{self.order.id}/pay/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], "success")
+
+    def test_slow_gateway_times_out(self):
+        base_url = self.start_gateway(latency=1)
+        with override_settings(PAYMENT_GATEWAY={"BASE_URL": base_url, "READ_TIMEOUT": 0.1}):
+            response = self.client.post(f"/api/orders/{self.order.id}/pay/")
+        self.assertEqual(response.status_code, 500)
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.lamps = Category.objects.create(title="Lamps", slug="lamps")
+        self.desks = Category.objects.create(title="Desks", slug="desks")
+        Product.objects.create(name="Desk lamp", old_price=20, category=self.lamps, discount=True, inventory=0)
+        Product.objects.create(name="Floor lamp", old_price=120, category=self.lamps, top_deal=True)
+        Product.objects.create(name="Oak desk", old_price=600, category=self.desks, flash_sales=True)
+        Product.objects.create(name="Lamp shade", old_price=30)
+
+    def test_facets_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/products/facets/")
+        facets = response.data
+        self.assertEqual(facets["count"], 4)
+        self.assertEqual([(c["slug"], c["count"]) for c in facets["categories"]], [("lamps", 2), ("desks", 1), (None, 1)])
+        self.assertEqual((facets["discount"], facets["top_deal"], facets["flash_sales"], facets["in_stock"]), (1, 1, 1, 3))
+        self.assertEqual((facets["price"]["min"], facets["price"]["max"]), (20, 600))
+        self.assertEqual([bucket["count"] for bucket in facets["price"]["buckets"]], [1, 1, 0, 1, 0, 1, 0])
+
+    def test_buckets_match_the_price_filters(self):
+        Product.objects.create(name="Edge", old_price=25)
+        buckets = self.client.get("/api/products/facets/").data["price"]["buckets"]
+        for bucket in buckets:
+            params = {"old_price__gte": bucket["min"], **({"old_price__lt": bucket["max"]} if bucket["max"] is not None else {})}
+            self.assertEqual(len(self.client.get("/api/products/", params).data["results"]), bucket["count"], bucket)
+
+    def test_in_stock_counts_reservations(self):
+        lamp = Product.objects.get(name="Floor lamp")
+        lamp.inventory = 2
+        lamp.save()
+        Reservation.objects.create(cart=Cart.objects.create(), product=lamp, quantity=2, expires_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(self.client.get("/api/products/facets/").data["in_stock"], 2)
+
+    def test_search_and_filters(self):
+        facets = self.client.get("/api/products/facets/", {"search": "lamp", "old_price__gt": 25}).data
+        self.assertEqual(facets["count"], 2)
+        self.assertEqual(facets["top_deal"], 1)
+        facets = self.client.get("/api/products/facets/", {"category_id": self.lamps.pk}).data
+        self.assertEqual([c["slug"] for c in facets["categories"]], ["lamps"])
+        self.assertEqual(self.client.get("/api/products/facets/", {"category_id": "nope"}).status_code, 400)
+
+    def test_cached_per_normalized_filters(self):
+        self.client.get("/api/products/facets/", {"search": "Lamp", "old_price__gt": 25})
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/products/facets/", {"old_price__gt": 25, "search": " lamp ", "ordering": "-old_price"})
+        self.assertEqual(response.data["count"], 2)
+        Product.objects.create(name="Wall lamp", old_price=40) # a product change invalidates them
+        self.assertEqual(self.client.get("/api/products/facets/", {"search": "lamp", "old_price__gt": 25}).data["count"], 3)
+
+
+@override_settings(DEALS={"SIZE": 2, "DEBOUNCE": 0})
+class DealsFeedTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        # run the pending rebuild, it would stand in for the ones the tests' own changes register
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheap = Product.objects.create(name="Cheap deal", old_price=5, top_deal=True)
+            self.mid = Product.objects.create(name="Mid deal", old_price=50, top_deal=True)
+            Product.objects.create(name="Dear deal", old_price=500, top_deal=True)
+            Product.objects.create(name="Flash", old_price=20, flash_sales=True)
+        get_cache().delete_many([snapshot_key(feed) for feed in FEEDS])
+
+    def test_snapshot_is_served_from_the_cache(self):
+        response = self.client.get("/api/deals/top-deals/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Cheap deal", "Mid deal"]) # cheapest first, SIZE
+        self.assertEqual([p["name"] for p in self.client.get("/api/deals/flash-sales/").data["results"]], ["Flash"])
+        with self.assertNumQueries(0):
+            again = self.client.get("/api/deals/top-deals/")
+        self.assertEqual(again.data["version"], response.data["version"])
+        self.assertEqual(self.client.get("/api/deals/top-deals/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.client.get("/api/deals/nope/").status_code, 404)
+
+    @override_settings(DEALS={"SIZE": 2, "DEBOUNCE": 0, "TTL": 0.05})
+    def test_snapshots_expire(self):
+        # a worker whose cache misses the rebuilds of the others still picks up changes after TTL
+        version = self.client.get("/api/deals/top-deals/").data["version"]
+        time.sleep(0.1)
+        self.assertGreater(self.client.get("/api/deals/top-deals/").data["version"], version)
+
+    def test_product_changes_rebuild_after_commit(self):
+        version = self.client.get("/api/deals/top-deals/").data["version"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mid.top_deal = False
+            self.mid.save()
+        response = self.client.get("/api/deals/top-deals/")
+        self.assertGreater(response.data["version"], version)
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Cheap deal", "Dear deal"])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.phone = Product.objects.create(name="Smartphone Pro", description="A phone with a great camera")
+        self.case = Product.objects.create(name="Leather case", description="Fits the smartphone pro")
+        self.lamp = Product.objects.create(name="Desk lamp", description="Warm light")
+
+    def search(self, text, **params):
+        response = self.client.get("/api/products/", {"search": text, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product["name"] for product in response.data["results"]]
+
+    def test_ranked_by_relevance(self):
+        # a match in the name outranks a match in the description
+        self.assertEqual(self.search("smartphone"), ["Smartphone Pro", "Leather case"])
+
+    def test_prefix_and_all_terms(self):
+        self.assertEqual(self.search("smartph"), ["Smartphone Pro", "Leather case"])
+        self.assertEqual(self.search("smartphone camera"), ["Smartphone Pro"])
+        self.assertEqual(self.search("lamp OR phone"), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.lamp.name = "Smartphone stand"
+        self.lamp.save()
+        self.assertIn("Smartphone stand", self.search("smartphone"))
+        self.lamp.delete()
+        self.assertNotIn("Smartphone stand", self.search("smartphone"))
+
+    def test_explicit_ordering_wins(self):
+        Product.objects.filter(pk=self.case.pk).update(old_price=1)
+        self.assertEqual(self.search("smartphone", ordering="old_price"), ["Leather case", "Smartphone Pro"])
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(title="Shoes", slug="shoes")
+        # duplicate prices so the id tiebreaker matters
+        for i in range(25):
+            Product.objects.create(name=f"Product {i}", old_price=10 * (i % 7), category=self.category if i % 2 else None)
+
+    def walk(self, params):
+        names, url, pages = [], "/api/products/", 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            names += [product["name"] for product in response.data["results"]]
+            pages += 1
+            if response.data["next"] is None:
+                return names, pages, response
+            response = self.client.get(response.data["next"])
+
+    def test_cursor_walk_by_price(self):
+        names, pages, _ = self.walk({"ordering": "-old_price", "page_size": 4})
+        expected = list(Product.objects.order_by("-old_price", "pk").values_list("name", flat=True))
+        self.assertEqual(names, expected)
+        self.assertEqual(pages, 7)
+
+    def test_cursor_walk_with_filter(self):
+        names, _, _ = self.walk({"category_id": self.category.category_id, "old_price__gt": 10, "ordering": "old_price", "page_size": 3})
+        expected = list(Product.objects.filter(category=self.category, old_price__gt=10).order_by("old_price", "pk").values_list("name", flat=True))
+        self.assertEqual(names, expected)
+
+    def test_previous_link(self):
+        first = self.client.get("/api/products/", {"ordering": "old_price", "page_size": 5})
+        second = self.client.get(first.data["next"])
+        back = self.client.get(second.data["previous"])
+        self.assertEqual(back.data["results"], first.data["results"])
+        self.assertIsNone(first.data["previous"])
+
+    def test_page_queries_no_count(self):
+        first = self.client.get("/api/products/", {"page_size": 5})
+        with self.assertNumQueries(2): # products + images, no COUNT(*)
+            self.client.get(first.data["next"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/products/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_for_staff(self):
+        staff = User.objects.create_user(email="admin@example.com", password="secret-pass-123", is_staff=True)
+        self.client.force_authenticate(staff)
+        response = self.client.get("/api/products/", {"page": 2, "page_size": 10})
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(len(response.data["results"]), 10)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(title="Books", slug="books")
+        self.product = Product.objects.create(name="Novel", category=self.category)
+        Review.objects.create(product=self.product, name="Ann", description="Great")
+
+    def test_cached_until_product_changes(self):
+        first = self.client.get("/api/products/")
+        with self.assertNumQueries(0):
+            cached = self.client.get("/api/products/")
+        self.assertEqual(cached.data, first.data)
+
+        self.product.name = "Short story"
+        self.product.save()
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.data["results"][0]["name"], "Short story")
+
+    def test_category_change_invalidates_products(self):
+        self.client.get(f"/api/products/{self.product.id}/")
+        self.category.title = "Novels"
+        self.category.save()
+        response = self.client.get(f"/api/products/{self.product.id}/")
+        self.assertEqual(response.data["category"]["title"], "Novels")
+
+    def test_reviews_invalidated_per_product(self):
+        url = f"/api/products/{self.product.id}/reviews/"
+        self.assertEqual(len(self.client.get(url).data["results"]), 1)
+        Review.objects.create(product=self.product, name="Bob", description="Fine")
+        self.assertEqual(len(self.client.get(url).data["results"]), 2)
+
+    def test_etag_not_modified(self):
+        response = self.client.get("/api/categories/")
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            not_modified = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+        Category.objects.create(title="Music", slug="music")
+        response = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class BenchApiTests(TestCase):
+    def test_every_scenario_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f"{directory}/results.json"
+            call_command("bench_api", requests=3, warmup=1, concurrency=1, products=5, host="testserver", output=output, stdout=io.StringIO())
+            with open(output) as file:
+                results = json.load(file)["results"]
+        self.assertEqual(list(results), SCENARIOS)
+        for name, result in results.items():
+            self.assertEqual((name, result["requests"], result["errors"]), (name, 3, 0))
+            self.assertIsNotNone(result["latency_ms"]["p99"])
+        self.assertEqual(results["products-search"]["empty"], 0) # the bulk created products are in the search index
+        # everything the run created is gone
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(User.objects.exists())
+
+
+class GenerateDataTests(TestCase):
+    def test_generate(self):
+        options = {"categories": 3, "products": 40, "users": 4, "reviews": 60, "carts": 6, "orders": 8, "stdout": io.StringIO()}
+        call_command("generate_data", seed=7, **options)
+        self.assertEqual((Category.objects.count(), Product.objects.count(), Review.objects.count(), Order.objects.count()), (3, 40, 60, 8))
+        self.assertEqual(sum(Product.objects.values_list("review_count", flat=True)), 60) # counters rebuilt
+        for order in Order.objects.prefetch_related("items"):
+            self.assertAlmostEqual(order.total_price, sum(item.unit_price * item.quantity for item in order.items.all()), places=1)
+        self.assertEqual(self.client.get("/api/products/", {"search": Product.objects.first().name.split()[0]}).status_code, 200)
+
+        names = set(Product.objects.values_list("name", flat=True))
+        Review.objects.all().delete()
+        OrderItem.objects.all().delete()
+        Order.objects.all().delete()
+        User.objects.all().delete()
+        Product.objects.all().delete()
+        Category.objects.all().delete()
+        Cart.objects.all().delete()
+        call_command("generate_data", seed=7, **options)
+        self.assertEqual(set(Product.objects.values_list("name", flat=True)), names) # same seed, same rows
+
+
+class ExplainEndpointsTests(TestCase):
+    def test_plans(self):
+        self.assertEqual(sequential_scans("SCAN storeapp_profile\nSCAN storeapp_product USING INDEX product_price_idx"), ["storeapp_profile"])
+        self.assertEqual(sequential_scans("SCAN storeapp_product_fts VIRTUAL TABLE INDEX 0:M3"), [])
+
+    def test_audit(self):
+        category = Category.objects.create(title="Lamps", slug="lamps")
+        product = Product.objects.create(name="Lamp", old_price=20, category=category)
+        Review.objects.create(product=product, name="reader")
+        self.client.get("/api/categories/") # cached, the audit still runs the queries
+        out = io.StringIO()
+        call_command("explain_endpoints", host="testserver", ignore=["storeapp_profile"], stdout=out)
+        output = out.getvalue()
+        self.assertNotIn("/api/categories/ -> 200, 0 queries", output)
+        self.assertIn(f"/api/products/?category_id={category.pk}", output)
+        self.assertIn(f"/api/products/{product.pk}/reviews/ -> 200", output)
+        self.assertIn("queries explained", output)
+
+
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email="staff@example.com", password="secret-pass-123", is_staff=True)
+        self.category = Category.objects.create(title="Toys", slug="toys")
+        self.existing = Product.objects.create(name="Old name", old_price=5, inventory=1)
+
+    def upload(self, name, content, **data):
+        file = io.BytesIO(content.encode())
+        file.name = name
+        return self.client.post("/api/products/import/", {"file": file, **data}, format="multipart")
+
+    def test_staff_only(self):
+        response = self.upload("products.csv", "name\nBall\n")
+        self.assertEqual(response.status_code, 401)
+
+    def test_csv_import(self):
+        self.client.force_authenticate(self.staff)
+        content = (
+            "id,name,category,old_price,discount,images\n"
+            f"{self.existing.id},New name,toys,,,\n"
+            ",Ball,toys,12.5,true,img/ball-1.jpg|img/ball-2.jpg\n"
+            ",Kite,kites,3,false,\n"
+            ",,toys,3,false,\n"
+        )
+        response = self.upload("products.csv", content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["rows"], 4)
+        self.assertEqual(response.data["imported"], 2)
+        self.assertEqual(response.data["error_count"], 2)
+        self.assertEqual(response.data["images"], 2)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, "New name")
+        self.assertEqual(self.existing.inventory, 1) # not in the file, left alone
+        self.assertEqual(self.existing.category, self.category)
+        ball = Product.objects.get(name="Ball")
+        self.assertTrue(ball.discount)
+        self.assertEqual(ball.images.count(), 2)
+        # imported rows are searchable
+        search = self.client.get("/api/products/", {"search": "ball"})
+        self.assertEqual([product["name"] for product in search.data["results"]], ["Ball"])
+
+    def test_blank_cells_keep_stored_values(self):
+        self.client.force_authenticate(self.staff)
+        kept = Product.objects.create(name="Existing", description="keep me", old_price=55, inventory=3, category=self.category)
+        ProductImage.objects.create(product=kept, image="img/old.jpg")
+        content = (
+            "id,name,description,old_price,images\n"
+            f"{kept.id},Existing renamed,,,img/new.jpg\n"
+            f"{self.existing.id},Old name,,7,\n"
+        )
+        generation = get_generation("products")
+        response = self.upload("products.csv", content)
+        self.assertEqual((response.data["imported"], response.data["error_count"]), (2, 0))
+        self.assertEqual(get_generation("products"), generation + 1) # once for the import, not per replaced image
+        kept.refresh_from_db()
+        self.assertEqual((kept.name, kept.description, kept.old_price, kept.inventory), ("Existing renamed", "keep me", 55, 3))
+        self.assertEqual(kept.category, self.category)
+        self.assertEqual([image.image.name for image in kept.images.all()], ["img/new.jpg"])
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.old_price, self.existing.inventory), (7, 1))
+
+    def test_jsonl_import_in_chunks(self):
+        from .importer import import_products
+        lines = "\n".join(f'{{"name": "Item {i}", "category": "toys", "old_price": {i}}}' for i in range(25))
+        with CaptureQueriesContext(connection) as queries:
+            report = import_products(io.StringIO(lines + "\nnot json\n"), "jsonl", chunk_size=5)
+        # a fixed number of queries per chunk (savepoint, upsert, search index, release) + one category lookup
+        self.assertLessEqual(len(queries), 6 * 5 + 1)
+        self.assertEqual(report["imported"], 25)
+        self.assertEqual(report["errors"][0]["line"], 26)
+
+
+@override_settings(IMAGE_PIPELINE={"WORKERS": 0, "THUMBNAIL_SIZE": (64, 64)})
+class ProductImagePipelineTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.client = APIClient()
+
+    def make_image(self, name, color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 600), color).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_upload_renders_variants_and_dedupes(self):
+        uploads = [self.make_image("red.png", "red"), self.make_image("red-again.png", "red"), self.make_image("blue.png", "blue")]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/products/", {"name": "Poster", "uploaded_images": uploads}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+
+        images = list(ProductImage.objects.filter(product__name="Poster").order_by("pk"))
+        self.assertEqual(len(images), 3)
+        self.assertEqual(len({image.image.name for image in images}), 2)
+        for image in images:
+            self.assertTrue(image.thumbnail and image.webp)
+            with Image.open(image.thumbnail.path) as thumbnail:
+                self.assertLessEqual(max(thumbnail.size), 64)
+
+        # a later upload of a stored file reuses the file and its variants
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/products/", {"name": "Poster 2", "uploaded_images": [self.make_image("blue-2.png", "blue")]}, format="multipart")
+        self.assertEqual(ProductImage.objects.values("image").distinct().count(), 2)
+        copy = ProductImage.objects.get(product__name="Poster 2")
+        blue = next(image for image in images if "blue" in image.image.name)
+        self.assertEqual(copy.webp.name, blue.webp.name)
+
+        detail = self.client.get(f"/api/products/{copy.product_id}/")
+        self.assertTrue(detail.data["images"][0]["thumbnail"].endswith(".jpg"))
+
+
+class AddCartItemTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        self.product = Product.objects.create(name="Mug")
+
+    def test_add_twice_increments_one_row(self):
+        url = f"/api/carts/{self.cart.id}/items/"
+        first = self.client.post(url, {"product": str(self.product.id), "quantity": 2})
+        with self.assertNumQueries(3): # product validation + upsert + cart last_activity touch
+            second = self.client.post(url, {"product": str(self.product.id), "quantity": 3})
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(second.data["quantity"], 5)
+        self.assertEqual(Cartitems.objects.get(cart=self.cart).quantity, 5)
+
+    def test_product_required(self):
+        response = self.client.post(f"/api/carts/{self.cart.id}/items/", {"quantity": 1})
+        self.assertEqual(response.status_code, 400)
+
+
+class CartActivityTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Mug")
+
+    def make_cart(self, idle_days, items=1):
+        cart = Cart.objects.create()
+        for _ in range(items):
+            Cartitems.objects.create(cart=cart, product=Product.objects.create(name="Cup"), quantity=1)
+        Cart.objects.filter(pk=cart.pk).update(last_activity=timezone.now() - timedelta(days=idle_days))
+        return cart
+
+    def test_item_changes_touch_the_cart(self):
+        cart = self.make_cart(idle_days=2)
+        self.client.post(f"/api/carts/{cart.id}/items/", {"product": str(self.product.id), "quantity": 1})
+        cart.refresh_from_db()
+        self.assertGreater(cart.last_activity, timezone.now() - timedelta(minutes=1))
+
+        # a fresh cart isn't written again
+        self.assertEqual(Cart.objects.touch(cart.pk), 0)
+
+    def test_purge_idle_carts(self):
+        old = [self.make_cart(idle_days=40, items=2) for _ in range(5)]
+        recent = self.make_cart(idle_days=3)
+
+        out = io.StringIO()
+        call_command("purge_carts", days=30, dry_run=True, stdout=out)
+        self.assertIn("5 carts idle for more than 30 days, with 10 items", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 6)
+
+        call_command("purge_carts", days=30, batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(Cart.objects.values_list("pk", flat=True)), [recent.pk])
+        self.assertFalse(Cartitems.objects.filter(cart__in=[cart.pk for cart in old]).exists())
+
+
+class ConcurrentAddCartItemTests(TransactionTestCase):
+    threads = 8
+    adds_per_thread = 15
+
+    def setUp(self):
+        # threads share sqlite's in-memory test database through one shared cache, where writers fail with
+        # "database table is locked" instead of waiting, a file test database (TEST["NAME"]) queues them
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("needs a file-backed sqlite test database")
+
+    def test_concurrent_adds_of_the_same_product(self):
+        cart = Cart.objects.create()
+        product = Product.objects.create(name="Hot item")
+        url = f"/api/carts/{cart.id}/items/"
+        errors = []
+        start = threading.Barrier(self.threads)
+
+        def add():
+            client = APIClient()
+            try:
+                start.wait()
+                for _ in range(self.adds_per_thread):
+                    response = client.post(url, {"product": str(product.id), "quantity": 1})
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        items = Cartitems.objects.filter(cart=cart)
+        self.assertEqual(items.count(), 1)
+        self.assertEqual(items.get().quantity, self.threads * self.adds_per_thread)
+
+
+class CartItemBatchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.cart = Cart.objects.create()
+        self.products = [Product.objects.create(name=f"Product {i}", old_price=10) for i in range(30)]
+        Cartitems.objects.create(cart=self.cart, product=self.products[0], quantity=4)
+        Cartitems.objects.create(cart=self.cart, product=self.products[1], quantity=4)
+        self.url = f"/api/carts/{self.cart.id}/items/batch/"
+
+    def test_batch_operations(self):
+        operations = [
+            {"op": "add", "product": str(self.products[0].id), "quantity": 1}, # 4 + 1
+            {"op": "remove", "product": str(self.products[1].id)},
+            {"op": "set", "product": str(self.products[2].id), "quantity": 7},
+            {"op": "add", "product": str(self.products[2].id), "quantity": 1}, # set 7 then + 1
+            {"op": "add", "product": str(self.products[3].id), "quantity": 2},
+            {"op": "add", "product": str(self.products[3].id), "quantity": 2},
+        ]
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, 200)
+        quantities = {item["product"]["name"]: item["quantity"] for item in response.data["items"]}
+        self.assertEqual(quantities, {"Product 0": 5, "Product 2": 8, "Product 3": 4})
+        self.assertEqual(response.data["total"], 17 * 10)
+
+    def test_restore_large_cart_in_constant_queries(self):
+        operations = [{"op": "add", "product": str(product.id), "quantity": 1} for product in self.products]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 30)
+        self.assertLessEqual(len(queries), 8)
+
+    def test_unknown_product_rejects_whole_batch(self):
+        operations = [
+            {"op": "add", "product": str(self.products[5].id), "quantity": 1},
+            {"op": "add", "product": "00000000-0000-0000-0000-000000000000", "quantity": 1},
+        ]
+        response = self.client.post(self.url, {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cartitems.objects.filter(product=self.products[5]).exists())
+
+    def test_quantities_past_the_column_range(self):
+        product = str(self.products[0].id)
+        adds = [{"op": "add", "product": product, "quantity": 20000}] * 2
+        response = self.client.post(self.url, {"operations": adds}, format="json")
+        self.assertEqual(response.status_code, 400) # folded to 40000
+        response = self.client.post(self.url, {"operations": [
+            {"op": "add", "product": str(self.products[5].id), "quantity": 1},
+            {"op": "add", "product": product, "quantity": 32765}, # 4 already in the cart
+        ]}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Cartitems.objects.get(cart=self.cart, product=self.products[0]).quantity, 4)
+        self.assertFalse(Cartitems.objects.filter(product=self.products[5]).exists()) # nothing of the batch applied
+        response = self.client.post(f"/api/carts/{self.cart.id}/items/", {"product": product, "quantity": 32764})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, {"operations": [{"op": "add", "product": product, "quantity": 32763}]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Cartitems.objects.get(cart=self.cart, product=self.products[0]).quantity, 32767)
+
+    def test_malformed_cart_id(self):
+        response = self.client.post("/api/carts/not-a-uuid/items/batch/", {"operations": [{"op": "remove", "product": str(self.products[0].id)}]}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_quantity_required(self):
+        response = self.client.post(self.url, {"operations": [{"op": "set", "product": str(self.products[5].id)}]}, format="json")
+        self.assertEqual(response.status_code, 400)
@@ -29,7 +29,8 @@ cart_router.register("items", views.CartItemViewset, basename="cart_items")
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(products_router.urls)),
-    path('', include(cart_router.urls))
+    path('', include(cart_router.urls)),
+    path('deals/<slug:feed>/', views.deals_feed, name='deals'),
 
 #     # path("products", views.ApiProducts.as_view()),
 #     # path("products/<str:pk>", views.ApiProduct.as_view()), # uuid so str only
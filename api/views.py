@@ -1,87 +1,109 @@
-import uuid
 from rest_framework.decorators import api_view, action
-from .serializers import ProductSerilaizer, CategorySerializer, ReviewSerializer, CartSerializer, ProductReadSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, ProfileSerializer, OrderSerializer, CreateOrderSerializer
-from storeapp.models import Product, Category, Review, Cart, Cartitems, Profile, Order, OrderItem
+from .serializers import ProductSerilaizer, CategorySerializer, ReviewSerializer, CartSerializer, ProductReadSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, ProfileSerializer, OrderSerializer, CreateOrderSerializer, CartItemBatchSerializer, ReservationSerializer, CategoryReadSerializer
+from storeapp.models import Product, Category, Review, Cart, Cartitems, Profile, Order, OrderItem, ProductImage, InsufficientStock
+from storeapp.reservations import reserve_cart, release_cart
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from django.http import Http404, HttpResponse
-from rest_framework import status
+from rest_framework import generics, status
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import ProductFilter
+from .filters import ProductFilter, ProductSearchFilter
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.pagination import PageNumberPagination
+from .pagination import ProductPagination, ReviewPagination
+from .cache import CachedReadMixin, get_document
+from .deals import FEEDS, get_snapshot
+from .facets import get_facets
+from .fieldsets import get_fieldset
+from .importer import import_products
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
-from rest_framework.permissions import IsAuthenticated
-import requests
-from django.conf import settings
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.parsers import MultiPartParser
+from .payments import get_payment_client, PaymentGatewayError
+from django.db.models import Prefetch
 
 # Create your views here.
 
 
 def initiate_payment(amount, email, order_id):
-    url = "https://api.flutterwave.com/v3/payments"
-    headers = {
-        "Authorization": f"Bearer {settings.FLW_SEC_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "tx_ref": str(uuid.uuid4()),
-        "amount": str(amount), 
-        "currency": "INR",
-        "redirect_url": f"http://localhost:8000/api/orders/confirm_payment/?o_id={order_id}", # formatted string literals
-        "meta": {
-            "consumer_id": 23,
-            "consumer_mac": "92a3-912ba-1192a"
-        },
-        # "max_retry_attempt": 2,
-        "customer": {
-            "email": email,
-            "phonenumber": "080****4528",
-            "name": "Yemi Desola"
-        },
-        "customizations": {
-            "title": "Easy Solution Payments",
-            "logo": "https://marketplace.canva.com/EAFvDRwEHHg/1/0/1600w/canva-colorful-abstract-online-shop-free-logo-cpI8ixEpis8.jpg"
-        }
-    }
-    
-
+    # the pooled client (api/payments.py) reuses keep-alive connections and gives up after the configured timeouts,
+    # so a stalled gateway can't hold a request worker forever
     try:
-        response = requests.post(url, headers=headers, json=data)
-        print('res', response)
-        response_data = response.json()
+        response_data = get_payment_client().create_payment(amount, email, order_id)
         return Response(response_data)
     
-    except requests.exceptions.RequestException as err:
-        print("the payment didn't go through", err)
+    except PaymentGatewayError as err:
         return Response({"error": str(err)}, status=500)
 
 
 
 
 
-class ProductViewset(ModelViewSet): # performs CRUD operations
-    queryset = Product.objects.all()
+class ProductViewset(CachedReadMixin, ModelViewSet): # performs CRUD operations
+    cache_namespace = "products"
+    # select_related joins the category into the product query and prefetch_related loads every image of the page in one extra query,
+    # so the nested CategorySerializer and ProductImageSerializer don't fire one query per product
+    queryset = Product.objects.select_related("category").prefetch_related("images").defer("search_vector")
     # serializer_class = ProductSerilaizer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     # filterset_fields = ["category", "old_price"]
     filterset_class = ProductFilter
     search_fields = ["name", "description"]
     ordering_fields = ["old_price"] # to pass query params as ?ordering=old_price or ordering=-old_price
-    pagination_class = PageNumberPagination
+    pagination_class = ProductPagination # keyset (?cursor=) pages, staff can opt in to ?page= numbers
+
+    def get_queryset(self):
+        fieldset = get_fieldset(self.request) if self.request.method == "GET" else None
+        if fieldset is None:
+            return super().get_queryset().with_available() # inventory minus reserved units, in the same query
+
+        # ?fields= only loads, joins and prefetches what the selected fields need (old_price is the ordering / cursor column)
+        queryset = fieldset.only(Product.objects.all(), computed={"price": ["old_price", "discount"], "available": ["inventory"]}, required=["old_price"])
+        if fieldset.expands("category"):
+            queryset = queryset.select_related("category")
+        if fieldset.expands("images"):
+            queryset = queryset.prefetch_related("images")
+        elif fieldset.selects("images"):
+            queryset = queryset.prefetch_related(Prefetch("images", queryset=ProductImage.objects.only("id", "product")))
+        if fieldset.selects("available"):
+            queryset = queryset.with_available()
+        return queryset
 
     def get_serializer_class(self):
         if self.request.method in ["GET"]:
             return ProductReadSerializer
         return ProductSerilaizer
 
-class ReviewViewset(ModelViewSet):
+    # GET /products/facets/ sidebar counts for the same ?search= and filters as the listing, see api/facets.py
+    @action(detail=False, methods=["GET"])
+    def facets(self, request):
+        names = [*self.filterset_class.base_filters, ProductSearchFilter.search_param]
+        return Response(get_facets(request.query_params, names, lambda: self.filter_queryset(Product.objects.all())))
+
+    # bulk import for staff, upload a csv or jsonl file as "file" (multipart), see api/importer.py for the columns
+    @action(detail=False, methods=["POST"], url_path="import", permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"file": ["No file was submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+        format = request.data.get("format") or upload.name.rsplit(".", 1)[-1].lower()
+        dry_run = request.data.get("dry_run") in ["1", "true", "True"]
+        try:
+            report = import_products(upload.file, format, dry_run=dry_run)
+        except ValueError as err:
+            return Response({"format": [str(err)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+
+class ReviewViewset(CachedReadMixin, ModelViewSet):
     # queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination # ?cursor= pages, newest first
+
+    def get_cache_namespace(self):
+        return f"reviews:{self.kwargs['product_pk']}"
 
     def get_queryset(self):
         return Review.objects.filter(product=self.kwargs["product_pk"])
@@ -91,15 +113,66 @@ class ReviewViewset(ModelViewSet):
         return {"product": self.kwargs["product_pk"]}
 
 
-class CategoryViewset(ModelViewSet):
+class CategoryViewset(CachedReadMixin, ModelViewSet):
+    cache_namespace = "categories"
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def get_queryset(self):
+        if self.request.method == "GET":
+            return Category.objects.with_counts().order_by("title")
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.request.method == "GET":
+            return CategoryReadSerializer
+        return CategorySerializer
+
+    # GET /categories/nav/ every category with its counts and featured product as one document, built once
+    # after each product / category change and served from the cache (with an ETag) until the next one
+    @action(detail=False, methods=["GET"])
+    def nav(self, request):
+        document, etag = get_document("nav", self.cache_namespace, lambda: {
+            "categories": CategoryReadSerializer(Category.objects.with_counts().order_by("title"), many=True).data,
+        })
+        if etag in request.headers.get("If-None-Match", ""):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(document, headers={"ETag": etag})
+
 
 class CartViewset(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.with_totals()
     serializer_class = CartSerializer
 
+    def get_queryset(self):
+        fieldset = get_fieldset(self.request) if self.request.method == "GET" else None
+        if fieldset is None:
+            return super().get_queryset()
+        queryset = Cart.objects.only("id")
+        if fieldset.selects("total"):
+            queryset = queryset.with_totals(items=fieldset.expands("items"))
+        elif fieldset.expands("items"):
+            queryset = queryset.prefetch_related(Prefetch("items", queryset=Cartitems.objects.with_sub_total()))
+        if fieldset.selects("items") and not fieldset.expands("items"):
+            queryset = queryset.prefetch_related(Prefetch("items", queryset=Cartitems.objects.only("id", "cart")))
+        return queryset
+
+    # POST /carts/{id}/reservation/ holds the stock of the cart's flash sale items while the customer checks out
+    # (posting again renews it), DELETE gives it back, see storeapp/reservations.py
+    @action(detail=True, methods=["POST", "DELETE"])
+    def reservation(self, request, pk):
+        cart = generics.get_object_or_404(Cart.objects.only("id"), id=pk) # a 404 for malformed ids too, not a 500
+        if request.method == "DELETE":
+            release_cart(cart.id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        try:
+            reservations = reserve_cart(cart.id)
+        except InsufficientStock as err:
+            return Response({"products": [
+                {"product": product_id, "available": available} for product_id, available in err.shortages.items()
+            ]}, status=status.HTTP_409_CONFLICT)
+        return Response(ReservationSerializer(reservations, many=True).data)
+
 
 class CartItemViewset(ModelViewSet):
     # queryset = Cartitems.objects.all()
@@ -107,7 +180,7 @@ class CartItemViewset(ModelViewSet):
     http_method_names = ["get","post","patch","delete"]
 
     def get_queryset(self):
-        return Cartitems.objects.filter(cart=self.kwargs["cart_pk"])
+        return Cartitems.objects.filter(cart=self.kwargs["cart_pk"]).with_sub_total()
     
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -118,6 +191,30 @@ class CartItemViewset(ModelViewSet):
     
     def get_serializer_context(self):
         return {"cart_id": self.kwargs["cart_pk"]}
+
+    # every item change counts as activity on the cart, idle carts are deleted by `manage.py purge_carts`
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        Cart.objects.touch(self.kwargs["cart_pk"])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        Cart.objects.touch(self.kwargs["cart_pk"])
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        Cart.objects.touch(self.kwargs["cart_pk"])
+
+    # POST /carts/{cart_pk}/items/batch/ {"operations": [{"op": "add" | "set" | "remove", "product": id, "quantity": n}, ...]}
+    # applies every operation in one transaction and returns the updated cart
+    @action(detail=False, methods=["POST"])
+    def batch(self, request, cart_pk):
+        generics.get_object_or_404(Cart.objects.all(), id=cart_pk) # a 404 for malformed ids too, not a 500
+        serializer = CartItemBatchSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        Cart.objects.touch(cart.pk)
+        return Response(CartSerializer(cart).data)
     
 
 class OrderViewset(ModelViewSet):
@@ -152,9 +249,20 @@ class OrderViewset(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(owner=user)
+        queryset = Order.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(owner=user)
+        # pay only needs the stored total_price, listings need the items with their products
+        if self.action in ["list", "retrieve"]:
+            fieldset = get_fieldset(self.request)
+            if fieldset is None or fieldset.expands("items"):
+                queryset = queryset.prefetch_related(Prefetch("items", queryset=OrderItem.objects.select_related("product")))
+            elif fieldset.selects("items"):
+                queryset = queryset.prefetch_related(Prefetch("items", queryset=OrderItem.objects.only("id", "order")))
+            if fieldset is not None:
+                queryset = fieldset.only(queryset)
+            queryset = queryset.order_by("-placed_at") # newest first, along order_owner_placed_idx
+        return queryset
     
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -162,13 +270,25 @@ class OrderViewset(ModelViewSet):
         return OrderSerializer
     
     def get_serializer_context(self):
-        return {"user_id": self.request.user.id}
+        return {**super().get_serializer_context(), "user_id": self.request.user.id} # the request is used for ?fields=
 
 
 class ProfileViewset(ModelViewSet):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
 
+
+# GET /deals/top-deals/ and /deals/flash-sales/ precomputed snapshots read from the cache, see api/deals.py
+@api_view(["GET"])
+def deals_feed(request, feed):
+    if feed not in FEEDS:
+        raise Http404
+    document = get_snapshot(feed)
+    etag = f'W/"deals-{feed}-{document["version"]}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(document, headers={"ETag": etag})
+
 # class ApiProducts(ListCreateAPIView): # Extends: GenericAPIView, ListModelMixin, CreateModelMixin
 #     queryset = Product.objects.all()
 #     serializer_class = ProductSerilaizer
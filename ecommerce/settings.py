@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware', # first, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -97,6 +98,29 @@ DATABASES = {
 
 
 
+# "catalog" holds the cached product/category/review responses (api/cache.py). They are invalidated by bumping
+# generation numbers kept in the same cache, so with several processes (gunicorn workers, servers) it must be a
+# backend they all share, otherwise a write in one worker leaves the others serving stale responses until TIMEOUT:
+#   CATALOG_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CATALOG_CACHE_LOCATION=redis://127.0.0.1:6379/1
+#   CATALOG_CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache CATALOG_CACHE_LOCATION=127.0.0.1:11211
+# the default, locmem, is per process (tests, runserver, a single worker) and evicts the least recently used
+# entries past MAX_ENTRIES, give redis an LRU maxmemory-policy for the same behaviour
+CATALOG_CACHE_BACKEND = os.environ.get('CATALOG_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': CATALOG_CACHE_BACKEND,
+        'LOCATION': os.environ.get('CATALOG_CACHE_LOCATION', 'catalog'),
+        'TIMEOUT': 600,
+    },
+}
+if CATALOG_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['catalog']['OPTIONS'] = {'MAX_ENTRIES': 5000}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -156,7 +180,11 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication', # simplejwt's JWTAuthentication with the users cached
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer', # same output as JSONRenderer, uses orjson when it's installed
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
@@ -174,4 +202,52 @@ DJOSER = {
     }
 }
 
-FLW_SEC_KEY  ='FLWSECK_TEST-825d260605a1fb0170d7af0cc15520f5-X'
\ No newline at end of file
+FLW_SEC_KEY  ='FLWSECK_TEST-825d260605a1fb0170d7af0cc15520f5-X'
+
+# timeouts, retries and pool size for api/payments.py, see PAYMENT_GATEWAY_DEFAULTS there
+# FLW_BASE_URL can point at the local stand-in started with `python manage.py fake_gateway`
+PAYMENT_GATEWAY = {
+    'BASE_URL': os.environ.get('FLW_BASE_URL', 'https://api.flutterwave.com/v3'),
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'RETRIES': 2,
+}
+
+# product image variants (thumbnail + webp), rendered by a process pool, see storeapp/images.py
+IMAGE_PIPELINE = {
+    'WORKERS': 2,
+    'THUMBNAIL_SIZE': (320, 320),
+}
+
+# stock held for carts in checkout, see storeapp/reservations.py
+# cached product responses and deals snapshots refresh when a hold expires in the worker that made it, with
+# several workers CACHES['catalog'] must be shared for the others to follow before the release_reservations sweep
+RESERVATIONS = {
+    'TTL': 600,
+    'FLASH_SALES_ONLY': True,
+}
+
+# home page deals snapshots, rebuilt DEBOUNCE seconds after product changes, see api/deals.py
+# the rebuild runs in the worker that made the change, with several workers CACHES['catalog'] must be a shared
+# backend (redis, memcached) for the others to serve it, with locmem they serve their own copy for up to TTL seconds
+DEALS = {
+    'SIZE': 48,
+    'DEBOUNCE': 2.0, # api/tests.py runs with 0, no timer thread outlives a test
+    'TTL': 300,
+}
+
+# users of authenticated requests, cached by api.authentication.CachedJWTAuthentication. A deactivation or
+# password change reaches the other workers within LOCAL_TTL, the TTL layer in CACHES['catalog'] is only used
+# when that backend is shared by every worker (SHARED None detects it, locmem is per process)
+AUTH_CACHE = {
+    'TTL': 300,
+    'LOCAL_TTL': 5,
+    'LOCAL_SIZE': 1024,
+    'SHARED': None,
+}
+
+# per request query / serializer timings (Server-Timing header, histograms on /metrics/), see api/metrics.py
+METRICS = {
+    'ENABLED': os.environ.get('REQUEST_METRICS', 'on') == 'on',
+    'SERVER_TIMING': DEBUG,
+}
@@ -12,5 +12,6 @@ admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Cart)
 admin.site.register(Cartitems)
+admin.site.register(Reservation)
 admin.site.register(Order)
 admin.site.register(OrderItem)
\ No newline at end of file
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class StoreappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'storeapp'
+
+    def ready(self):
+        from . import signals # connects the signal receivers
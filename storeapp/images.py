@@ -0,0 +1,192 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Product image pipeline
+# uploads are stored as they come (after a content hash check, identical files are stored once) and the
+# thumbnail / webp variants are rendered later by a process pool, each original is decoded only once.
+# The worker function only gets bytes and returns bytes, so it works with any storage backend and the
+# worker processes never touch Django or the database.
+
+IMAGE_PIPELINE_DEFAULTS = {
+    "WORKERS": 2, # 0 renders in the calling thread (tests, management commands)
+    "THUMBNAIL_SIZE": (320, 320),
+    "THUMBNAIL_QUALITY": 80,
+    "WEBP_QUALITY": 80,
+}
+
+
+def pipeline_settings():
+    from django.conf import settings
+    return {**IMAGE_PIPELINE_DEFAULTS, **getattr(settings, "IMAGE_PIPELINE", {})}
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def render_variants(data, thumbnail_size, thumbnail_quality, webp_quality):
+    # runs in a worker process: decode once, return (thumbnail jpeg, full size webp) bytes
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    webp = io.BytesIO()
+    image.save(webp, "WEBP", quality=webp_quality, method=4)
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
+    if thumbnail.mode != "RGB":
+        background = Image.new("RGB", thumbnail.size, (255, 255, 255))
+        background.paste(thumbnail, mask=thumbnail.getchannel("A") if thumbnail.mode == "RGBA" else None)
+        thumbnail = background
+    jpeg = io.BytesIO()
+    thumbnail.save(jpeg, "JPEG", quality=thumbnail_quality, optimize=True)
+    return jpeg.getvalue(), webp.getvalue()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, forking a threaded server process (and its db connections) isn't safe
+                _executor = ProcessPoolExecutor(
+                    max_workers=pipeline_settings()["WORKERS"],
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def reset_executor():
+    # a pool whose worker died (e.g. killed for memory) refuses new work, the next render starts a new one
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def save_product_images(product, uploads):
+    """
+    Store the uploaded files as product images and queue their variants. A file already stored
+    (same sha256, also within the same upload) is not written again: the new row points at the stored
+    file and its variants. At most one lookup and two bulk inserts whatever the number of files.
+    """
+    from django.db import transaction
+    from django.db.models import Q
+    from .models import ProductImage
+
+    hashed = [(content_hash(upload), upload) for upload in uploads]
+    stored = {}
+    for image in ProductImage.objects.filter(content_hash__in={digest for digest, _ in hashed}).exclude(Q(image="") | Q(image__isnull=True)):
+        stored.setdefault(image.content_hash, image)
+
+    new = {}
+    for digest, upload in hashed:
+        if digest not in stored and digest not in new:
+            new[digest] = ProductImage(product=product, image=upload, content_hash=digest)
+    ProductImage.objects.bulk_create(new.values()) # the file fields write the files here
+    stored.update(new)
+
+    images, copies, used = [], [], set()
+    for digest, upload in hashed:
+        if digest in new and digest not in used:
+            used.add(digest)
+            images.append(new[digest])
+            continue
+        source = stored[digest]
+        copy = ProductImage(product=product, image=source.image.name, thumbnail=source.thumbnail.name,
+                            webp=source.webp.name, content_hash=digest)
+        copies.append(copy)
+        images.append(copy)
+    ProductImage.objects.bulk_create(copies)
+
+    pending = [image.pk for image in new.values()]
+    if pending:
+        transaction.on_commit(lambda: schedule_variants(pending))
+    return images
+
+
+def schedule_variants(image_ids):
+    # returns the futures of the renders handed to the pool (none when rendering inline)
+    config = pipeline_settings()
+    futures = []
+    for image_id in image_ids:
+        try:
+            data = read_original(image_id)
+        except Exception:
+            logger.exception("could not read product image %s", image_id)
+            continue
+        if data is None:
+            continue
+        args = (data, tuple(config["THUMBNAIL_SIZE"]), config["THUMBNAIL_QUALITY"], config["WEBP_QUALITY"])
+        if not config["WORKERS"]:
+            try:
+                record_variants(image_id, *render_variants(*args))
+            except Exception:
+                logger.exception("could not render product image %s", image_id)
+            continue
+        future = get_executor().submit(render_variants, *args)
+        future.add_done_callback(lambda future, image_id=image_id: on_rendered(image_id, future))
+        futures.append(future)
+    return futures
+
+
+def read_original(image_id):
+    from .models import ProductImage
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return None
+    with image.image.open("rb") as file:
+        return file.read()
+
+
+def on_rendered(image_id, future):
+    # runs on the executor's callback thread in this process, which has its own db connection
+    from django.db import connection
+    try:
+        record_variants(image_id, *future.result())
+    except BrokenProcessPool:
+        logger.exception("image worker died while rendering product image %s", image_id)
+        reset_executor()
+    except Exception:
+        logger.exception("could not render product image %s", image_id)
+    finally:
+        connection.close()
+
+
+def record_variants(image_id, thumbnail, webp):
+    from django.core.files.base import ContentFile
+    from django.db.models import Q
+    from .models import ProductImage
+
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None:
+        return
+    name = image.image.name.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    image.thumbnail.save(f"{name}.jpg", ContentFile(thumbnail), save=False)
+    image.webp.save(f"{name}.webp", ContentFile(webp), save=False)
+    image.save(update_fields=["thumbnail", "webp"]) # post_save invalidates the cached product responses
+    # duplicates uploaded before this one was processed share its variants
+    ProductImage.objects.filter(Q(thumbnail="") | Q(thumbnail__isnull=True), content_hash=image.content_hash).exclude(pk=image.pk).update(
+        thumbnail=image.thumbnail.name, webp=image.webp.name
+    )
@@ -0,0 +1,325 @@
+import io
+import random
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from storeapp.models import DISCOUNT_RATE, Cart, Cartitems, Category, Order, OrderItem, Product, ProductImage, Review
+from storeapp.search import rebuild_product_index
+
+# Synthetic store data for scale testing
+# the same --seed generates the same rows (ids, names, prices, quantities; dates are relative to the run).
+# Popularity is skewed with a zipf law: a few categories hold most products (long tail), a few hot products
+# get most of the reviews, cart items and order items, a few users place most orders.
+# Rows are written in batches with bulk_create, or COPY on postgresql for the tables whose ids are generated here.
+
+COUNTS = { # at --scale 1
+    "categories": 50,
+    "products": 10000,
+    "users": 1000,
+    "reviews": 50000,
+    "carts": 5000,
+    "orders": 10000,
+}
+BATCH_SIZE = 5000
+WORDS = [
+    "classic", "smart", "wireless", "organic", "compact", "premium", "vintage", "portable", "ergonomic", "eco",
+    "lamp", "chair", "phone", "desk", "kettle", "jacket", "camera", "watch", "speaker", "blender", "sofa", "backpack",
+]
+PASSWORD = "synthetic-password" # every generated user can log in with it
+
+
+def zipf_cum_weights(count, skew):
+    # cumulative weights of ranks 1..count, rank r drawn with probability ~ 1 / r ** skew
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+class SkewedChoice:
+    """ Draws items with zipf popularity, the hot items are a seeded shuffle of the population (not the first ones created) """
+
+    def __init__(self, rng, population, skew):
+        self.rng = rng
+        self.items = list(population)
+        rng.shuffle(self.items)
+        self.cum_weights = zipf_cum_weights(len(self.items), skew)
+        self.total = self.cum_weights[-1]
+
+    def __call__(self):
+        return self.items[bisect_left(self.cum_weights, self.rng.random() * self.total)]
+
+    def distinct(self, count):
+        chosen = {}
+        for _ in range(count * 3):
+            item = self()
+            chosen[id(item)] = item
+            if len(chosen) == count:
+                break
+        return list(chosen.values())
+
+
+def copy_text(value):
+    # a value in postgresql's COPY text format
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+@contextmanager
+def keep_dates(*fields):
+    # auto_now_add would overwrite the generated dates in bulk_create
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Writer:
+    """ Buffers model instances and writes them in batches, reporting progress and rows per second """
+
+    def __init__(self, command, name, model, total, batch_size, use_copy, after=()):
+        self.command = command
+        self.name = name
+        self.model = model
+        self.total = total # None when it's only known at the end
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.after = after # writers of the rows these point at, flushed first
+        self.pending = []
+        self.written = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+
+    def add(self, instance):
+        self.pending.append(instance)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        for writer in self.after:
+            writer.flush()
+        with transaction.atomic():
+            if self.use_copy:
+                self.copy(self.pending)
+            else:
+                self.model.objects.bulk_create(self.pending, batch_size=self.batch_size)
+        self.written += len(self.pending)
+        self.pending = []
+        now = time.perf_counter()
+        if now - self.reported >= 1:
+            self.reported = now
+            progress = self.written if self.total is None else f"{self.written}/{self.total}"
+            self.command.stdout.write(f"  {self.name}: {progress} ({self.rate():.0f} rows/s)")
+
+    def copy(self, instances):
+        # database generated ids are left out, the database assigns them
+        fields = [field for field in self.model._meta.concrete_fields if not field.generated and not (field.primary_key and field.db_returning)]
+        quote = connection.ops.quote_name
+        sql = f"COPY {quote(self.model._meta.db_table)} ({', '.join(quote(field.column) for field in fields)}) FROM STDIN"
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy"): # psycopg 3
+                with raw.copy(sql) as copy:
+                    for instance in instances:
+                        copy.write_row([field.get_db_prep_save(getattr(instance, field.attname), connection) for field in fields])
+            else: # psycopg2
+                buffer = io.StringIO()
+                for instance in instances:
+                    buffer.write("\t".join(copy_text(field.get_db_prep_save(getattr(instance, field.attname), connection)) for field in fields))
+                    buffer.write("\n")
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+
+    def rate(self):
+        return self.written / max(time.perf_counter() - self.started, 1e-9)
+
+    def close(self):
+        self.flush()
+        return self.written, time.perf_counter() - self.started
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the store with synthetic categories, products (with images), users, reviews, carts and orders, with skewed "
+        "popularity, deterministic from --seed. Counts are --scale times the defaults unless given explicitly. "
+        "Writes skip model signals: the search index and review counters are rebuilt at the end, cached api responses expire on their own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=float, default=1.0, help=", ".join(f"{name} {count}" for name, count in COUNTS.items()) + " at 1")
+        for name in COUNTS:
+            parser.add_argument(f"--{name}", type=int)
+        parser.add_argument("--images", type=int, default=2, help="images per product, at most")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent of the popularity of categories, products and users")
+        parser.add_argument("--days", type=int, default=365, help="dates are spread over the last DAYS days")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--no-copy", action="store_true", help="bulk_create on postgresql too")
+
+    def handle(self, *args, **options):
+        counts = {name: options[name] if options[name] is not None else max(1, round(count * options["scale"])) for name, count in COUNTS.items()}
+        if options["batch_size"] < 1 or any(count < 1 for count in counts.values()):
+            raise CommandError("counts and --batch-size must be positive")
+        self.rng = random.Random(options["seed"])
+        self.options = options
+        self.use_copy = connection.vendor == "postgresql" and not options["no_copy"]
+        self.now = timezone.now()
+        self.run = f"s{options['seed']}"
+        if get_user_model().objects.filter(email=self.email(0)).exists():
+            raise CommandError(f"seed {options['seed']} was already generated in this database, use another --seed")
+
+        self.stdout.write(f"generating {', '.join(f'{count} {name}' for name, count in counts.items())} (seed {options['seed']})")
+        started = time.perf_counter()
+        self.summary = []
+        categories = self.generate_categories(counts["categories"])
+        products = self.generate_products(counts["products"], categories)
+        users = self.generate_users(counts["users"])
+        self.generate_reviews(counts["reviews"], products)
+        self.generate_carts(counts["carts"], products)
+        self.generate_orders(counts["orders"], products, users)
+
+        finishing = time.perf_counter()
+        self.update_review_counters()
+        rebuild_product_index()
+        self.stdout.write(f"review counters and search index rebuilt in {time.perf_counter() - finishing:.1f}s")
+
+        elapsed = time.perf_counter() - started
+        rows = sum(written for _, written, _ in self.summary)
+        for name, written, seconds in self.summary:
+            self.stdout.write(f"  {name:<16} {written:>10} rows {seconds:>8.1f}s {written / max(seconds, 1e-9):>10.0f} rows/s")
+        self.stdout.write(self.style.SUCCESS(f"{rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)"))
+
+    # helpers
+
+    def uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def email(self, number):
+        return f"{self.run}-user{number}@synthetic.test"
+
+    def past(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.options["days"] * 86400))
+
+    def writer(self, name, model, total=None, after=(), returns_ids=False):
+        # COPY returns no ids, bulk_create does (the rows pointing at users and orders need them)
+        return Writer(self, name, model, total, self.options["batch_size"], self.use_copy and not returns_ids, after)
+
+    def finish(self, writer):
+        written, seconds = writer.close()
+        self.summary.append((writer.name, written, seconds))
+
+    # tables, in foreign key order
+
+    def generate_categories(self, count):
+        writer = self.writer("categories", Category, count)
+        ids = []
+        for number in range(count):
+            category_id = self.uuid()
+            title = f"{self.rng.choice(WORDS).title()} {number}"
+            writer.add(Category(category_id=category_id, title=title, slug=f"{self.run}-category-{number}"))
+            ids.append(category_id)
+        self.finish(writer)
+        return ids
+
+    def generate_products(self, count, categories):
+        category = SkewedChoice(self.rng, categories, self.options["skew"]) # long tail categories
+        products = self.writer("products", Product, count)
+        images = self.writer("product images", ProductImage, after=[products])
+        catalog = [] # (id, price) of every product, enough for the rows pointing at them
+        for number in range(count):
+            product_id = self.uuid()
+            name = " ".join(self.rng.sample(WORDS, 3)).capitalize()
+            old_price = round(self.rng.lognormvariate(3.5, 1), 2)
+            discount = self.rng.random() < 0.2
+            products.add(Product(
+                id=product_id, name=f"{name} {number}", slug=f"{self.run}-product-{number}",
+                description=" ".join(self.rng.choices(WORDS, k=self.rng.randint(10, 60))),
+                old_price=old_price, discount=discount, inventory=self.rng.randint(0, 500), category_id=category(),
+                top_deal=self.rng.random() < 0.02, flash_sales=self.rng.random() < 0.01,
+            ))
+            catalog.append((product_id, round(old_price - DISCOUNT_RATE * old_price, 2) if discount else old_price))
+            for image in range(self.rng.randint(1, self.options["images"]) if self.options["images"] else 0):
+                images.add(ProductImage(product_id=product_id, image=f"img/synthetic/{product_id.hex}-{image}.jpg"))
+        self.finish(products)
+        self.finish(images)
+        return catalog
+
+    def generate_users(self, count):
+        password = make_password(PASSWORD) # hashing is slow, every user shares one hash
+        writer = self.writer("users", get_user_model(), count, returns_ids=True)
+        for number in range(count):
+            writer.add(get_user_model()(email=self.email(number), password=password, date_joined=self.past()))
+        self.finish(writer)
+        # bulk_create doesn't return ids on every database, read them back
+        users = get_user_model().objects.filter(email__startswith=f"{self.run}-user", email__endswith="@synthetic.test")
+        return list(users.order_by("pk").values_list("pk", flat=True))
+
+    def generate_reviews(self, count, products):
+        product = SkewedChoice(self.rng, products, self.options["skew"]) # hot products get most reviews
+        writer = self.writer("reviews", Review, count)
+        with keep_dates(Review._meta.get_field("date_created")):
+            for number in range(count):
+                writer.add(Review(
+                    product_id=product()[0], name=f"reviewer {self.rng.randrange(count)}", date_created=self.past(),
+                    description=" ".join(self.rng.choices(WORDS, k=self.rng.randint(5, 30))),
+                ))
+            self.finish(writer)
+
+    def generate_carts(self, count, products):
+        product = SkewedChoice(self.rng, products, self.options["skew"])
+        carts = self.writer("carts", Cart, count)
+        items = self.writer("cart items", Cartitems, after=[carts])
+        with keep_dates(Cart._meta.get_field("created")):
+            for number in range(count):
+                cart_id = self.uuid()
+                created = self.past()
+                carts.add(Cart(id=cart_id, created=created, last_activity=min(self.now, created + timedelta(minutes=self.rng.randint(0, 600)))))
+                for product_id, _ in product.distinct(self.rng.randint(0, 6)): # one row per (cart, product)
+                    items.add(Cartitems(cart_id=cart_id, product_id=product_id, quantity=self.rng.randint(1, 4)))
+            self.finish(carts)
+        self.finish(items)
+
+    def generate_orders(self, count, products, users):
+        product = SkewedChoice(self.rng, products, self.options["skew"])
+        owner = SkewedChoice(self.rng, users, self.options["skew"]) # repeat customers
+        statuses = [Order.PAYMENT_STATUS_COMPLETE] * 8 + [Order.PAYMENT_STATUS_PENDING, Order.PAYMENT_STATUS_FAILED]
+        orders = self.writer("orders", Order, count, returns_ids=True)
+        items = self.writer("order items", OrderItem)
+        batch = [] # orders waiting for their ids
+        with keep_dates(Order._meta.get_field("placed_at")):
+            for number in range(count):
+                lines = [(product_id, price, self.rng.randint(1, 3)) for product_id, price in product.distinct(self.rng.randint(1, 5))]
+                order = Order(owner_id=owner(), placed_at=self.past(), pending_status=self.rng.choice(statuses),
+                              total_price=round(sum(price * quantity for _, price, quantity in lines), 2))
+                batch.append((order, lines))
+                orders.add(order)
+                if not orders.pending: # just written, the orders have their ids
+                    self.add_order_items(items, batch)
+                    batch = []
+            self.finish(orders)
+        self.add_order_items(items, batch)
+        self.finish(items)
+
+    def add_order_items(self, items, orders):
+        for order, lines in orders:
+            for product_id, price, quantity in lines:
+                items.add(OrderItem(order_id=order.pk, product_id=product_id, quantity=quantity, unit_price=price))
+
+    def update_review_counters(self):
+        # what storeapp/signals.py maintains for reviews saved one by one
+        Product.objects.recount_reviews()
@@ -0,0 +1,33 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from storeapp.images import schedule_variants
+from storeapp.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Render the missing thumbnail / webp variants of product images with the image process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--all", action="store_true", help="re-render images that already have variants")
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.exclude(Q(image="") | Q(image__isnull=True))
+        if not options["all"]:
+            images = images.filter(Q(thumbnail="") | Q(thumbnail__isnull=True))
+        # one image per stored file, rows sharing a file get the variants copied over
+        ids = list(images.order_by("content_hash", "pk").distinct().values_list("pk", "content_hash"))
+        seen, pending = set(), []
+        for pk, digest in ids:
+            if not digest or digest not in seen:
+                seen.add(digest)
+                pending.append(pk)
+
+        batch_size = options["batch_size"]
+        for start in range(0, len(pending), batch_size):
+            wait(schedule_variants(pending[start:start + batch_size]))
+            self.stdout.write(f"{min(start + batch_size, len(pending))}/{len(pending)} images processed")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from storeapp.models import Cart, Cartitems
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Delete carts (and their items and reservations) without item changes for more than --days days, in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--sleep", type=float, default=0.0, help="seconds to pause between batches, to spread the load")
+        parser.add_argument("--dry-run", action="store_true", help="only report how many carts and items would be deleted")
+
+    def handle(self, *args, **options):
+        if options["days"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--days and --batch-size must be positive")
+        idle = Cart.objects.idle(options["days"])
+
+        if options["dry_run"]:
+            carts = idle.count()
+            items = Cartitems.objects.filter(cart__in=idle).count()
+            self.stdout.write(f"{carts} carts idle for more than {options['days']} days, with {items} items")
+            return
+
+        deleted = {"carts": 0, "items": 0}
+        while True:
+            # every batch is its own short transaction: a page of the last_activity index, then deletes by primary key
+            with transaction.atomic():
+                ids = list(idle.order_by("last_activity").values_list("pk", flat=True)[:options["batch_size"]])
+                if not ids:
+                    break
+                # idle is checked again in the DELETE, a cart that got an item meanwhile is kept
+                _, counts = idle.filter(pk__in=ids).delete()
+            deleted["carts"] += counts.get(Cart._meta.label, 0)
+            deleted["items"] += counts.get(Cartitems._meta.label, 0)
+            self.stdout.write(f"deleted {deleted['carts']} carts so far")
+            if len(ids) < options["batch_size"]:
+                break
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted['carts']} idle carts and {deleted['items']} items"))
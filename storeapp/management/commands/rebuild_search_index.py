@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from storeapp.search import rebuild_product_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full text index, needed after writes that skip post_save (bulk_create, update, raw sql)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        rebuild_product_index(options["database"])
+        self.stdout.write(self.style.SUCCESS("Product search index rebuilt"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from storeapp.reservations import SWEEP_BATCH_SIZE, expired_reservations, release_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired cart stock reservations in batches, run it every minute or so"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="only count the expired reservations")
+
+    def handle(self, *args, **options):
+        if options["dry_run"]:
+            self.stdout.write(f"{expired_reservations().count()} expired reservations")
+            return
+        released = release_expired(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations"))
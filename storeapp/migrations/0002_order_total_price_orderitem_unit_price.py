@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+
+def backfill_order_totals(apps, schema_editor):
+    # existing orders get the prices their products have now, which is what total_price used to report
+    Order = apps.get_model('storeapp', 'Order')
+    OrderItem = apps.get_model('storeapp', 'OrderItem')
+    for order in Order.objects.prefetch_related('items__product').iterator(chunk_size=500):
+        items = list(order.items.all())
+        for item in items:
+            price = item.product.old_price
+            if item.product.discount:
+                price = price - ((30/100)*price)
+            item.unit_price = price
+        OrderItem.objects.bulk_update(items, ['unit_price'])
+        order.total_price = sum([item.unit_price * item.quantity for item in items])
+        order.save(update_fields=['total_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+# the DDL is copied from storeapp/search.py as it was when this migration was written,
+# later changes to that module must not change what this migration does
+FTS_TABLE = 'storeapp_product_fts'
+
+
+def create_and_fill_search_index(apps, schema_editor):
+    # the GIN index (postgresql) / FTS5 table (sqlite) live outside the model state
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS storeapp_product_search_vector_gin ON storeapp_product USING gin (search_vector)"
+        )
+        Product = apps.get_model('storeapp', 'Product')
+        Product.objects.using(schema_editor.connection.alias).update(
+            search_vector=SearchVector('name', weight='A', config='simple') + SearchVector('description', weight='B', config='simple')
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(product_id UNINDEXED, name, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (product_id, name, description) SELECT id, name, COALESCE(description, '') FROM storeapp_product"
+        )
+
+
+def remove_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS storeapp_product_search_vector_gin")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0002_order_total_price_orderitem_unit_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_and_fill_search_index, remove_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0003_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='img/thumbnails'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='webp',
+            field=models.ImageField(blank=True, null=True, upload_to='img/webp'),
+        ),
+    ]
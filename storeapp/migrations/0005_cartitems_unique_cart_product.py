@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_items(apps, schema_editor):
+    # concurrent adds could create the same product twice in a cart, fold them into the oldest row
+    Cartitems = apps.get_model('storeapp', 'Cartitems')
+    duplicates = (
+        Cartitems.objects.values('cart', 'product')
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(rows__gt=1, cart__isnull=False, product__isnull=False)
+    )
+    for duplicate in duplicates.iterator():
+        Cartitems.objects.filter(id=duplicate['keep']).update(quantity=min(duplicate['total'], 32767))
+        Cartitems.objects.filter(cart=duplicate['cart'], product=duplicate['product']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0004_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitems',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
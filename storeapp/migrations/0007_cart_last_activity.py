@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:37
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_last_activity(apps, schema_editor):
+    # items have no timestamps, the creation time is the best known activity of existing carts
+    Cart = apps.get_model('storeapp', 'Cart')
+    Cart.objects.update(last_activity=F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0006_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_review_counters(apps, schema_editor):
+    Product = apps.get_model('storeapp', 'Product')
+    Review = apps.get_model('storeapp', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by()
+    Product.objects.update(
+        review_count=Coalesce(Subquery(reviews.values('product').annotate(total=Count('id')).values('total'), output_field=IntegerField()), Value(0)),
+        last_reviewed_at=Subquery(reviews.order_by('-date_created').values('date_created')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storeapp', '0007_cart_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_reviewed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'date_created', 'id'], name='review_product_created_idx'),
+        ),
+        migrations.RunPython(backfill_review_counters, migrations.RunPython.noop),
+    ]
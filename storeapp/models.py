@@ -1,12 +1,40 @@
 # from email.policy import default
-from django.db import models
+from contextlib import nullcontext
+from datetime import timedelta
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Count, F, FloatField, Max, OuterRef, Prefetch, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
 from django.contrib.auth.models import User
 from  django.conf import settings
 
 # Create your models here.
 # current python intrepreter is not the same as virtual environment
+
+DISCOUNT_RATE = 30/100
+
+
+def effective_price(prefix=""):
+    # database side version of Product.price, prefix is the lookup path to the product (e.g. "product__" from Cartitems)
+    old_price = F(f"{prefix}old_price")
+    return Case(
+        When(**{f"{prefix}discount": True}, then=old_price - (Value(DISCOUNT_RATE) * old_price)),
+        default=old_price,
+        output_field=FloatField(),
+    )
         
+class CategoryQuerySet(models.QuerySet):
+    def with_counts(self):
+        # product counts by conditional aggregation and the featured product joined in, all in the category query
+        return self.select_related("featured_product").annotate(
+            product_count=Count("products"),
+            discounted_count=Count("products", filter=Q(products__discount=True)),
+            in_stock_count=Count("products", filter=Q(products__inventory__gt=0)),
+        )
+
+
 class Category(models.Model):
     title = models.CharField(max_length=200) # by default max_length is 50
     category_id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, unique=True) # the datatype of uuid is uuid in postgres and mariadb, in other case it is charfield
@@ -14,20 +42,108 @@ class Category(models.Model):
     featured_product = models.OneToOneField('Product', on_delete=models.CASCADE, blank=True, null=True, related_name='featured_product')
     icon = models.CharField(max_length=100, default=None, blank = True, null=True)
 
+    objects = CategoryQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
 
+class ReviewQuerySet(models.QuerySet):
+    def delete(self):
+        # post_delete (storeapp/signals.py) only counts single review deletes, a bulk delete recounts
+        # the products it touched once, in the same transaction
+        with transaction.atomic(using=self.db):
+            product_ids = set(self.values_list("product", flat=True).distinct())
+            deleted = super().delete()
+            Product.objects.using(self.db).filter(pk__in=product_ids).recount_reviews()
+        return deleted
+
+
 class Review(models.Model):
     product = models.ForeignKey("Product", on_delete=models.CASCADE, related_name = "reviews")
     date_created = models.DateTimeField(auto_now_add=True)
     description = models.TextField(default="description")
     name = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            # a product's reviews newest first, for the keyset pages and the product's last_reviewed_at
+            models.Index(fields=["product", "date_created", "id"], name="review_product_created_idx"),
+        ]
+
+    objects = ReviewQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # the product's review counters are updated from post_save (storeapp/signals.py), inside this transaction
+        with transaction.atomic(using=kwargs.get("using") or router.db_for_write(Review, instance=self)):
+            super().save(*args, **kwargs)
     
     def __str__(self):
         return self.description
     
 
+MAX_CART_QUANTITY = 32767 # Cartitems.quantity is a PositiveSmallIntegerField
+
+
+class QuantityLimitExceeded(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids # products whose cart quantity would go past MAX_CART_QUANTITY
+        super().__init__(f"cart quantity above {MAX_CART_QUANTITY} for {len(product_ids)} product(s)")
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        self.shortages = shortages # {product_id: units available}
+        super().__init__(f"not enough stock for {len(shortages)} product(s)")
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_available(self):
+        # inventory minus the units held by unexpired cart reservations, a correlated subquery so no extra query
+        held = Reservation.objects.active().filter(product=OuterRef("pk")).order_by().values("product").annotate(total=Sum("quantity")).values("total")
+        return self.annotate(available=F("inventory") - Coalesce(Subquery(held, output_field=models.IntegerField()), Value(0)))
+
+    def recount_reviews(self):
+        # review_count / last_reviewed_at from the reviews table, for writes that skip the per review signals
+        reviews = Review.objects.filter(product=OuterRef("pk")).order_by().values("product")
+        return self.update(
+            review_count=Coalesce(Subquery(reviews.annotate(total=Count("id")).values("total"), output_field=models.IntegerField()), Value(0)),
+            last_reviewed_at=Subquery(reviews.annotate(last=Max("date_created")).values("last")),
+        )
+
+    def check_stock(self, quantities, cart_id=None):
+        """
+        Lock the rows of the products in quantities ({product_id: quantity}) in primary key order, so
+        concurrent checkouts of the same products queue up instead of deadlocking, and raise InsufficientStock
+        when the inventory not held by other carts' reservations doesn't cover them. Must run in a transaction.
+        """
+        ids = sorted(quantities)
+        stock = dict(self.select_for_update().filter(pk__in=ids).order_by("pk").values_list("pk", "inventory"))
+        held = Reservation.objects.using(self.db).held(ids, exclude_cart=cart_id)
+        available = {pk: stock.get(pk, 0) - held.get(pk, 0) for pk in ids}
+        shortages = {pk: max(available[pk], 0) for pk in ids if available[pk] < quantities[pk]}
+        if shortages:
+            raise InsufficientStock(shortages)
+
+    def take_stock(self, quantities, cart_id=None):
+        """
+        Decrement inventory by {product_id: quantity}, all or nothing, after check_stock(). The decrement is
+        a single conditional UPDATE that can never go below zero. The reservations of cart_id (the cart checking
+        out) don't count against it and are consumed. Raises InsufficientStock (and changes nothing) when any product is short.
+        """
+        ids = sorted(quantities)
+        with transaction.atomic(using=self.db):
+            self.check_stock(quantities, cart_id=cart_id)
+
+            needed = Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()], output_field=models.IntegerField())
+            updated = self.filter(pk__in=ids, inventory__gte=needed).update(inventory=F("inventory") - needed)
+            if updated != len(ids): # only reachable where select_for_update is a no-op (sqlite), the savepoint is rolled back
+                stock = dict(self.filter(pk__in=ids).values_list("pk", "inventory"))
+                raise InsufficientStock({pk: stock.get(pk, 0) for pk in ids if stock.get(pk, 0) < quantities[pk]})
+            if cart_id is not None:
+                Reservation.objects.using(self.db).filter(cart_id=cart_id).delete()
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
@@ -40,12 +156,29 @@ class Product(models.Model):
     inventory = models.IntegerField(default=5)
     top_deal=models.BooleanField(default=False)
     flash_sales = models.BooleanField(default=False)
+    search_vector = SearchVectorField(null=True, editable=False) # full text index on postgresql, see storeapp/search.py
+    # maintained with every review create / delete (storeapp/signals.py), so reads never count reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the listing's access paths: ?category_id= with an old_price range / ordering, and ?ordering=old_price alone,
+            # id is the keyset pagination tiebreaker
+            models.Index(fields=["category", "old_price", "id"], name="product_category_price_idx"),
+            models.Index(fields=["old_price", "id"], name="product_price_idx"),
+            # small slices of the catalog, partial so they only hold the flagged products
+            models.Index(fields=["old_price", "id"], condition=Q(top_deal=True), name="product_top_deal_idx"),
+            models.Index(fields=["old_price", "id"], condition=Q(flash_sales=True), name="product_flash_sales_idx"),
+        ]
     
 
     @property # this decorator used to make methods behave like attributes so that we can access as product.price instead of product.price()
     def price(self):
         if self.discount:
-            new_price = self.old_price - ((30/100)*self.old_price)
+            new_price = self.old_price - (DISCOUNT_RATE*self.old_price)
         else:
             new_price = self.old_price
         return new_price
@@ -64,11 +197,113 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="images")
     image = models.ImageField(upload_to="img", default="", null=True, blank=True) # upload_to, it creates a img folder within the media root directory
+    # variants rendered in the background by storeapp/images.py, empty until then
+    thumbnail = models.ImageField(upload_to="img/thumbnails", null=True, blank=True)
+    webp = models.ImageField(upload_to="img/webp", null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default="", db_index=True) # sha256 of the original, identical uploads share the stored files
+
+
+class CartitemsQuerySet(models.QuerySet):
+    def with_sub_total(self):
+        return self.select_related("product").annotate(sub_total=F("quantity") * effective_price("product__"))
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Add quantity of the product to the cart in one atomic statement: the row is created, or its
+        quantity incremented when the (cart, product) row already exists, so concurrent adds never lose
+        an increment or create a duplicate row. Returns the resulting Cartitems. Raises QuantityLimitExceeded
+        (and changes nothing) when the quantity would go past MAX_CART_QUANTITY.
+        """
+        return self.add_quantities(cart_id, {product_id: quantity})[0]
+
+    def add_quantities(self, cart_id, quantities):
+        # add_quantity() for many products ({product_id: quantity}) in a single statement
+        connection = connections[self.db]
+        if connection.vendor not in ("postgresql", "sqlite"):
+            return [self._add_quantity_fallback(cart_id, product_id, quantity) for product_id, quantity in quantities.items()]
+        if not quantities:
+            return []
+
+        meta = self.model._meta
+        quote = connection.ops.quote_name
+        table = quote(meta.db_table)
+        cart_field, product_field = meta.get_field("cart"), meta.get_field("product")
+        cart_column, product_column = quote(cart_field.column), quote(product_field.column)
+        sql = (
+            f"INSERT INTO {table} ({cart_column}, {product_column}, quantity) VALUES {', '.join(['(%s, %s, %s)'] * len(quantities))} "
+            f"ON CONFLICT ({cart_column}, {product_column}) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity "
+            f"WHERE {table}.quantity + EXCLUDED.quantity <= %s " # rows past the limit aren't updated nor returned
+            f"RETURNING {quote(meta.pk.column)}, {product_column}, quantity"
+        )
+        db_cart_id = cart_field.target_field.get_db_prep_value(cart_id, connection)
+        params = []
+        for product_id, quantity in quantities.items():
+            params += [db_cart_id, product_field.target_field.get_db_prep_value(product_id, connection), quantity]
+        params.append(MAX_CART_QUANTITY)
+        to_python = product_field.target_field.to_python
+        # a single product has nothing to roll back, several are all or nothing: in the caller's transaction
+        # (no savepoint, the exception has to end it) or in their own
+        with transaction.atomic(using=self.db, savepoint=False) if len(quantities) > 1 else nullcontext():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            # RETURNING rows aren't guaranteed to come back in VALUES order, match them up by product
+            returned = {to_python(product_id): (pk, quantity) for pk, product_id, quantity in rows}
+            over = [product_id for product_id in quantities if to_python(product_id) not in returned]
+            if over:
+                raise QuantityLimitExceeded(over)
+        items = []
+        for product_id in quantities:
+            pk, quantity = returned[to_python(product_id)]
+            items.append(self.model(pk=pk, cart_id=cart_id, product_id=to_python(product_id), quantity=quantity))
+        return items
+
+    def _add_quantity_fallback(self, cart_id, product_id, quantity):
+        # F() increment, then insert, the unique constraint turns a lost race into one more increment
+        items = self.filter(cart_id=cart_id, product_id=product_id)
+        below_limit = items.filter(quantity__lte=MAX_CART_QUANTITY - quantity)
+        if not below_limit.update(quantity=F("quantity") + quantity):
+            if items.exists():
+                raise QuantityLimitExceeded([product_id])
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            except IntegrityError:
+                if not below_limit.update(quantity=F("quantity") + quantity):
+                    raise QuantityLimitExceeded([product_id])
+        return items.get()
+
+
+CART_TOUCH_INTERVAL = timedelta(minutes=1)
+
+
+class CartQuerySet(models.QuerySet):
+    def touch(self, cart_id):
+        # record activity on the cart, at most once per CART_TOUCH_INTERVAL so a busy cart's row
+        # isn't rewritten on every item change (a single UPDATE that matches nothing when it's fresh)
+        now = timezone.now()
+        return self.filter(pk=cart_id, last_activity__lt=now - CART_TOUCH_INTERVAL).update(last_activity=now)
+
+    def idle(self, days):
+        # carts without item changes for the last `days` days, walks the last_activity index
+        return self.filter(last_activity__lt=timezone.now() - timedelta(days=days))
+
+    def with_totals(self, items=True):
+        # cart total is summed in the cart query, items come in one more query with their product and sub_total
+        queryset = self.annotate(
+            cart_total=Coalesce(Sum(F("items__quantity") * effective_price("items__product__")), Value(0.0)),
+        )
+        if items:
+            queryset = queryset.prefetch_related(Prefetch("items", queryset=Cartitems.objects.with_sub_total()))
+        return queryset
 
 
 class Cart(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True)
     created = models.DateTimeField(auto_now_add=True)
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True) # see CartQuerySet.touch(), purge_carts deletes the idle ones
+
+    objects = CartQuerySet.as_manager()
     # completed = models.BooleanField(default=False)
     # session_id = models.CharField(max_length=100)
     
@@ -96,6 +331,14 @@ class Cartitems(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, blank=True, null=True, related_name="items") # related_name creates a link between cart and cartitems model i.e. items field will be automatically created in the cart model
     product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=True, null=True, related_name='cartitems')
     quantity = models.PositiveSmallIntegerField(default=0)
+
+    objects = CartitemsQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # one row per product in a cart, add_quantity() relies on it for its upsert
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_cart_product"),
+        ]
     
     
     # @property
@@ -104,6 +347,33 @@ class Cartitems(models.Model):
     #     return subTotal
 
 
+class ReservationQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def held(self, product_ids, exclude_cart=None):
+        # {product_id: units held by unexpired reservations}
+        reservations = self.active().filter(product__in=product_ids)
+        if exclude_cart is not None:
+            reservations = reservations.exclude(cart_id=exclude_cart)
+        return dict(reservations.order_by().values("product").annotate(total=Sum("quantity")).values_list("product", "total"))
+
+
+class Reservation(models.Model):
+    # stock held for a cart while its owner is in checkout, see storeapp/reservations.py
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveSmallIntegerField()
+    expires_at = models.DateTimeField(db_index=True) # the sweeper walks this index
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_cart_reservation"),
+        ]
+
+
 class Profile(models.Model):
     name = models.CharField(max_length=30)
     bio = models.TextField()
@@ -127,20 +397,22 @@ class Order(models.Model):
     pending_status = models.CharField(
         max_length=50, choices=PAYMENT_STATUS_CHOICES, default='PAYMENT_STATUS_PENDING')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
+    # frozen at checkout so payment amounts don't change when product prices do
+    total_price = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner", "-placed_at"], name="order_owner_placed_idx"), # a user's orders, newest first
+        ]
     
     def __str__(self):
         return self.pending_status
-    
-    @property
-    def total_price(self):
-        order_items = self.items.all()
-        total = sum([item.product.price * item.quantity for item in order_items])
-        return total
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name = "items")
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.PositiveSmallIntegerField()
+    unit_price = models.FloatField(default=0) # product.price at the time the order was placed
     
     def __str__(self):
         return self.product.name
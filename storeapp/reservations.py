@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Cartitems, Product, Reservation
+
+# Cart stock reservations
+# a cart in checkout holds the stock of its (flash sale) items for TTL seconds: held units count against
+# Product.inventory for every other cart (Product.objects.check_stock / with_available) and are consumed
+# when the cart checks out. Expired reservations already stop counting, `manage.py release_reservations`
+# (run it every minute or so from cron) deletes them in batches. The api's cached responses follow an expiry
+# on their own (HOLDS_KEY in api/cache.py), in the other workers only through a shared CACHES["catalog"].
+
+RESERVATION_DEFAULTS = {
+    "TTL": 600, # seconds
+    "FLASH_SALES_ONLY": True, # only flash sale products are held, other products are checked at checkout only
+}
+SWEEP_BATCH_SIZE = 1000
+
+# sent when reservations change through bulk writes (no model signals), the api invalidates cached products on it
+reservations_changed = Signal()
+
+
+def reservation_settings():
+    from django.conf import settings
+    return {**RESERVATION_DEFAULTS, **getattr(settings, "RESERVATIONS", {})}
+
+
+def reserve_cart(cart_id):
+    """
+    Hold the stock of the cart's items for TTL seconds, replacing (and renewing) the cart's previous
+    reservations. Raises InsufficientStock, holding nothing new, when a product is short. Returns the reservations.
+    """
+    config = reservation_settings()
+    expires_at = timezone.now() + timedelta(seconds=config["TTL"])
+    with transaction.atomic():
+        items = Cartitems.objects.filter(cart=cart_id, product__isnull=False, quantity__gt=0)
+        if config["FLASH_SALES_ONLY"]:
+            items = items.filter(product__flash_sales=True)
+        quantities = dict(items.values_list("product", "quantity"))
+        if quantities:
+            Product.objects.check_stock(quantities, cart_id=cart_id)
+
+        Reservation.objects.filter(cart=cart_id).exclude(product__in=list(quantities)).delete()
+        reservations = Reservation.objects.bulk_create(
+            [Reservation(cart_id=cart_id, product_id=product_id, quantity=quantity, expires_at=expires_at) for product_id, quantity in quantities.items()],
+            update_conflicts=True,
+            unique_fields=["cart", "product"],
+            update_fields=["quantity", "expires_at"],
+        )
+    reservations_changed.send(sender=Reservation)
+    return reservations
+
+
+def release_cart(cart_id):
+    released, _ = Reservation.objects.filter(cart=cart_id).delete()
+    if released:
+        reservations_changed.send(sender=Reservation)
+    return released
+
+
+def expired_reservations(now=None):
+    return Reservation.objects.filter(expires_at__lte=now or timezone.now())
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Delete the reservations expired by now, batch_size rows at a time walking the expires_at index.
+    Every batch is its own short statement, so the sweep never holds many locks. Returns the number released.
+    """
+    now = timezone.now()
+    released = 0
+    while True:
+        ids = list(expired_reservations(now).order_by("expires_at").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            break
+        # expires_at is checked again, a reservation renewed meanwhile is kept
+        released += expired_reservations(now).filter(pk__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            break
+    if released:
+        reservations_changed.send(sender=Reservation)
+    return released
@@ -0,0 +1,110 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import F, FloatField
+from django.db.models.expressions import RawSQL
+
+# Product full text index
+# postgresql: Product.search_vector (tsvector) with a GIN index, kept up to date from the post_save signal
+# sqlite: an FTS5 shadow table storeapp_product_fts(product_id, name, description), so search works in local tests
+# other databases have no index and fall back to the icontains SearchFilter
+# the index / table are created by migration 0003_product_search_vector
+
+SEARCH_CONFIG = "simple" # no stemming, so prefix queries typed on every keystroke match what was typed
+FTS_TABLE = "storeapp_product_fts"
+
+
+def search_vendor(using=DEFAULT_DB_ALIAS):
+    vendor = connections[using].vendor
+    if vendor in ("postgresql", "sqlite"):
+        return vendor
+    return None
+
+
+def product_search_vector():
+    return SearchVector("name", weight="A", config=SEARCH_CONFIG) + SearchVector("description", weight="B", config=SEARCH_CONFIG)
+
+
+def search_terms(text):
+    # only word characters survive, so user input can't inject tsquery / FTS5 operators
+    return re.findall(r"\w+", text.lower())
+
+
+def db_product_id(pk, connection):
+    # the value stored in storeapp_product.id (uuids are stored as hex strings on sqlite)
+    from .models import Product
+    return Product._meta.pk.get_db_prep_value(pk, connection)
+
+
+def update_product_index(products, using=DEFAULT_DB_ALIAS):
+    # incremental update for the given (already saved) products
+    from .models import Product
+    vendor = search_vendor(using)
+    ids = [product.pk for product in products]
+    if not ids:
+        return
+    if vendor == "postgresql":
+        Product.objects.using(using).filter(pk__in=ids).update(search_vector=product_search_vector())
+    elif vendor == "sqlite":
+        connection = connections[using]
+        # copied from the table rather than the instances, which may be partial (deferred fields, upserts)
+        db_ids = [db_product_id(pk, connection) for pk in ids]
+        placeholders = ", ".join(["%s"] * len(db_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE product_id IN ({placeholders})", db_ids)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (product_id, name, description) "
+                f"SELECT id, name, COALESCE(description, '') FROM storeapp_product WHERE id IN ({placeholders})",
+                db_ids,
+            )
+
+
+def remove_from_product_index(pks, using=DEFAULT_DB_ALIAS):
+    if search_vendor(using) == "sqlite" and pks:
+        connection = connections[using]
+        db_ids = [db_product_id(pk, connection) for pk in pks]
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE product_id IN ({', '.join(['%s'] * len(db_ids))})", db_ids)
+
+
+def rebuild_product_index(using=DEFAULT_DB_ALIAS):
+    # full rebuild, for rows written without signals (bulk_create, queryset.update, raw sql)
+    from .models import Product
+    vendor = search_vendor(using)
+    if vendor == "postgresql":
+        Product.objects.using(using).update(search_vector=product_search_vector())
+    elif vendor == "sqlite":
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (product_id, name, description) SELECT id, name, COALESCE(description, '') FROM storeapp_product"
+            )
+
+
+def search_products(queryset, text):
+    """
+    Filter queryset to the products matching every term of text (prefix match) and annotate
+    search_rank, higher is more relevant. Returns None when the database has no full text index.
+    """
+    terms = search_terms(text)
+    vendor = search_vendor(queryset.db)
+    if vendor is None:
+        return None
+    if not terms:
+        return queryset
+
+    if vendor == "postgresql":
+        query = SearchQuery(" & ".join(f"{term}:*" for term in terms), search_type="raw", config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(search_rank=SearchRank(F("search_vector"), query))
+
+    match = " ".join(f'"{term}"*' for term in terms)
+    table = queryset.model._meta.db_table
+    # bm25() is lower for better matches, negated so search_rank sorts the same way on both databases
+    rank = RawSQL(
+        f"SELECT -bm25({FTS_TABLE}, 0, 10.0, 4.0) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.product_id = {table}.id",
+        (match,),
+        output_field=FloatField(),
+    )
+    matches = RawSQL(f"SELECT product_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank)
@@ -0,0 +1,46 @@
+from django.db.models import DateTimeField, F, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, Review
+from .search import remove_from_product_index, update_product_index
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, raw=False, **kwargs):
+    if not raw: # fixtures are indexed with `manage.py rebuild_search_index`
+        update_product_index([instance], using)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    remove_from_product_index([instance.pk], using)
+
+
+# review counters on Product, F() updates so concurrent reviews don't lose counts.
+# Review.save() and deletes (the deletion collector) run these inside the write's own transaction, on its database
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, using, raw=False, **kwargs):
+    if created and not raw:
+        created_at = Value(instance.date_created, output_field=DateTimeField())
+        Product.objects.using(using).filter(pk=instance.product_id).update(
+            review_count=F("review_count") + 1,
+            # greatest() is null on sqlite when one side is
+            last_reviewed_at=Greatest(Coalesce("last_reviewed_at", created_at), created_at),
+        )
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, using, origin=None, **kwargs):
+    # only for review.delete(), a queryset delete recounts once per product (ReviewQuerySet.delete) and reviews
+    # deleted along with their product (or its category) have no counters left to update
+    if not isinstance(origin, Review):
+        return
+    latest = Review.objects.using(using).filter(product=instance.product_id).order_by("-date_created").values("date_created")[:1]
+    Product.objects.using(using).filter(pk=instance.product_id).update(
+        review_count=Greatest(F("review_count") - 1, 0),
+        last_reviewed_at=Subquery(latest),
+    )